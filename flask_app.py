@@ -1,74 +1,81 @@
 import os
-import re
-from flask import Flask, request, jsonify
+import hmac
+import json
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, request, jsonify, Response, send_from_directory, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from modules.image_to_fen import get_fen_from_image
-from modules.chess_engine import get_top_moves_with_analysis, render_board_with_move
-from modules.groq_explainer import build_prompt, get_explanation_from_groq
-from modules.simulate_and_save_sequences import simulate_and_save_sequences
+from modules.image_to_fen import (
+    DetectionError, get_fen_from_upload, iter_fens_from_uploads, check_detected_fen, image_cache, decode_image_bytes
+)
+from modules.chess_engine import (
+    get_top_moves_with_analysis, get_top_moves_within_budget, render_board_artifact, ensure_board_artifact
+)
+from modules.groq_explainer import explain_moves
+from modules.simulate_and_save_sequences import (
+    register_sequences, sequence_registry, frame_names, ensure_sequence_frame, render_sequence_animation
+)
 from modules.eval_strategy import perform_advanced_analysis
+from modules.engine_pool import ENGINE_PATH, ENGINE_POOL_SIZE
+from modules.analysis_cache import analysis_cache
+from modules.fast_path import fast_path
+from modules.artifact_store import artifact_store, artifact_key, ARTIFACTS_DIR, ARTIFACT_CACHE_SECONDS
+from modules.jobs import job_manager
+from modules.game_analysis import GAME_DEPTH, GAME_MAX_DEPTH, GAME_MULTIPV, load_game, iter_game_analysis
+from modules.live_stream import STREAM_VIDEO_STRIDE, stream_registry, iter_video_frames
+from modules.model_registry import WEIGHTS_DIR, reload_model, sync_models, clear_published_models, registry
+from modules.startup import readiness
+from modules.metrics import span, timed, submit_traced, register_queue, render_metrics, RequestTimer
 import chess
 import chess.engine
 
-app = Flask(__name__)
-CORS(app)
+# Static files are served by serve_static below so artifacts can be produced on demand
+app = Flask(__name__, static_folder=None)
+# Admin endpoints are left out, so other sites' pages cannot call them from a browser
+CORS(app, resources={r'^/(?!api/model/).*': {'origins': '*'}})
 
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['ARTIFACTS_FOLDER'] = 'static/artifacts'
+app.config['STATIC_FOLDER'] = 'static'
+app.config['ARTIFACTS_FOLDER'] = ARTIFACTS_DIR
+# Required by /api/model/reload, which is disabled while it is unset
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
+# Artifact URLs are content-addressed, so browsers and proxies may cache them as long as they can be re-rendered
+app.config['ARTIFACT_CACHE_SECONDS'] = ARTIFACT_CACHE_SECONDS
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['ARTIFACTS_FOLDER'], exist_ok=True)
 
-def parse_explanation(explanation_text):
-    """Parse the explanation text into structured sections"""
-    parsed_explanation = {
-        "best_move_explanation": "",
-        "strategic_idea": "",
-        "tactical_motif": ""
-    }
-    
-    try:
-        text = explanation_text.replace("Here are the explanations:", "").strip()
-        sections = re.split(r'\d+\.\s*', text)
-        sections = [section.strip() for section in sections if section.strip()]
-        
-        for section in sections:
-            if "**Best Move Explanation**" in section or "Best Move Explanation" in section:
-                content = re.sub(r'\*\*Best Move Explanation\*\*:?\s*', '', section, flags=re.IGNORECASE)
-                content = re.split(r'\d+\.\s*\*\*', content)[0].strip()
-                parsed_explanation["best_move_explanation"] = content
-            
-            elif "**Strategic Idea**" in section or "Strategic Idea" in section:
-                content = re.sub(r'\*\*Strategic Idea\*\*:?\s*', '', section, flags=re.IGNORECASE)
-                content = re.split(r'\d+\.\s*\*\*', content)[0].strip()
-                parsed_explanation["strategic_idea"] = content
-            
-            elif "**Tactical Motif**" in section or "Tactical Motif" in section:
-                content = re.sub(r'\*\*Tactical Motif\*\*:?\s*', '', section, flags=re.IGNORECASE)
-                content = re.split(r'\d+\.\s*\*\*', content)[0].strip()
-                parsed_explanation["tactical_motif"] = content
-        
-        if not any(parsed_explanation.values()):
-            best_move_match = re.search(r'\*\*Best Move Explanation\*\*:?\s*(.*?)(?=\*\*Strategic Idea\*\*|\*\*Tactical Motif\*\*|$)', text, re.DOTALL | re.IGNORECASE)
-            strategic_match = re.search(r'\*\*Strategic Idea\*\*:?\s*(.*?)(?=\*\*Tactical Motif\*\*|\*\*Best Move Explanation\*\*|$)', text, re.DOTALL | re.IGNORECASE)
-            tactical_match = re.search(r'\*\*Tactical Motif\*\*:?\s*(.*?)(?=\*\*Best Move Explanation\*\*|\*\*Strategic Idea\*\*|$)', text, re.DOTALL | re.IGNORECASE)
-            
-            if best_move_match:
-                parsed_explanation["best_move_explanation"] = best_move_match.group(1).strip()
-            if strategic_match:
-                parsed_explanation["strategic_idea"] = strategic_match.group(1).strip()
-            if tactical_match:
-                parsed_explanation["tactical_motif"] = tactical_match.group(1).strip()
-        
-        if not any(parsed_explanation.values()):
-            parsed_explanation["best_move_explanation"] = explanation_text
-            
-    except Exception as e:
-        print(f"Error parsing explanation: {e}")
-        parsed_explanation["best_move_explanation"] = explanation_text
-    
-    return parsed_explanation
+# Engine work for batch requests; sized to the engine pool so searches never queue twice
+analysis_executor = ThreadPoolExecutor(max_workers=ENGINE_POOL_SIZE, thread_name_prefix='analysis')
+# Rendering, explanations and ranking that run side by side once the PVs exist
+stage_executor = ThreadPoolExecutor(max_workers=int(os.getenv('STAGE_WORKERS', '8')), thread_name_prefix='stage')
+register_queue('analysis', analysis_executor)
+register_queue('stage', stage_executor)
+# Each extra candidate move is another MultiPV line the engine has to search
+MAX_TOP_N = int(os.getenv('MAX_TOP_N', '10'))
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = RequestTimer(request.path)
+
+@app.before_request
+def start_warm_up():
+    # Covers `flask run`, which never reaches __main__; a no-op once warm-up has started
+    readiness.start_background_warm_up()
+
+@app.before_request
+def follow_model_reloads():
+    # A reload handled by another worker is picked up here, in the background
+    sync_models()
+
+@app.after_request
+def finish_request_timer(response):
+    # Label by route pattern, not concrete path, to keep the label set small
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        timer.finish(endpoint, request.method, response.status_code)
+    return response
 
 def convert_moves_to_string(pv_line):
     """Convert move objects to string notation"""
@@ -102,92 +109,193 @@ def format_score(score):
     else:
         return str(score)
 
+def serialize_suggestions(suggestions):
+    """Convert engine suggestions to JSON-friendly [move, pv, score] lists"""
+    serialized = []
+    for move, pv_line, score in suggestions:
+        move_uci = move.uci() if hasattr(move, 'uci') else str(move)
+        serialized.append([move_uci, convert_moves_to_string(pv_line), format_score(score)])
+    return serialized
+
+def analyze_fen(fen, top_n=3):
+    """Engine search plus advanced ranking for a single FEN (no rendering or LLM)"""
+    with span('engine_search'):
+        suggestions, _ = get_top_moves_with_analysis(fen, ENGINE_PATH, top_n=top_n)
+    best_move_data, all_moves_data, reasoning = timed(
+        'advanced_analysis', perform_advanced_analysis, fen, top_n=top_n, suggestions=suggestions
+    )
+    return {
+        'fen': fen,
+        'suggestions': serialize_suggestions(suggestions),
+        'advanced_analysis': {
+            'best_move': best_move_data,
+            'all_moves': all_moves_data,
+            'reasoning': reasoning
+        } if best_move_data else None
+    }
+
+def run_analysis_pipeline(publish, image_data, turn_code, top_n=3, time_budget=None,
+                          keep_deepening=False, wait_for_deepening=False, rank_all=False):
+    """
+    Full analysis of one uploaded image. Detection and engine search run first;
+    once the FEN and PVs exist, board rendering, LLM explanations and heuristic
+    ranking run concurrently. `publish(event, data)` is called with each partial
+    result as soon as it is available (fen, moves, rendered_images,
+    explanation, explanations, advanced_analysis).
+
+    With `time_budget` (seconds) the engine search is time-bounded instead of
+    fixed-depth; `keep_deepening` lets it continue in the background, publishing
+    `moves_update` events (and waiting for them if `wait_for_deepening`).
+    `rank_all` ranks every legal move in the advanced analysis, not just the PVs.
+    """
+    # Get FEN from image, decoded straight from the request buffer
+    print("Getting FEN from image...")
+    with span('detection'):
+        fen = get_fen_from_upload(image_data, turn_code)
+    print(f"Generated FEN: {fen}")
+    publish('fen', {'fen': fen})
+
+    # Analyze with chess engine (original analysis)
+    print("Analyzing with chess engine...")
+    deepening = None
+    with span('engine_search'):
+        if time_budget:
+            suggestions, board, search_depth, deepening = get_top_moves_within_budget(
+                fen, ENGINE_PATH, time_budget=time_budget, top_n=top_n, keep_deepening=keep_deepening,
+                on_update=lambda deeper, depth: publish(
+                    'moves_update', {'depth': depth, 'suggestions': serialize_suggestions(deeper)}
+                )
+            )
+        else:
+            search_depth = 20
+            suggestions, board = get_top_moves_with_analysis(fen, ENGINE_PATH, depth=search_depth, top_n=top_n)
+    print(f"Got {len(suggestions)} suggestions at depth {search_depth}")
+
+    # Register sequences; frames are rendered lazily when first requested
+    analysis_id, _ = register_sequences(board, suggestions)
+    publish('moves', {
+        'analysis_id': analysis_id,
+        'depth': search_depth,
+        'suggestions': serialize_suggestions(suggestions)
+    })
+
+    # Independent stages, all fed by the same FEN + PVs
+    # (submitted with the request's trace so their spans show up in slow-request reports)
+    render_futures = [
+        submit_traced(stage_executor, timed, 'render', render_board_artifact, board, move)
+        for move, _, _ in suggestions
+    ]
+    explain_future = submit_traced(
+        stage_executor, timed, 'explanation', explain_moves, fen, suggestions,
+        on_result=lambda idx, move_uci, explanation: publish(
+            'explanation', {'index': idx, 'move': move_uci, 'explanation': explanation}
+        ),
+        on_delta=lambda idx, move_uci, section, text: publish(
+            'explanation_delta', {'index': idx, 'move': move_uci, 'section': section, 'delta': text}
+        )
+    )
+    ranking_future = submit_traced(
+        stage_executor, timed, 'advanced_analysis', perform_advanced_analysis, fen,
+        top_n=top_n, suggestions=suggestions, depth=search_depth, rank_all=rank_all
+    )
+
+    rendered_images = [future.result() for future in render_futures]
+    publish('rendered_images', {'rendered_images': rendered_images})
+
+    best_move_data, all_moves_data, reasoning = ranking_future.result()
+    advanced_analysis = {
+        'best_move': best_move_data,
+        'all_moves': all_moves_data,
+        'reasoning': reasoning
+    } if best_move_data else None
+    publish('advanced_analysis', {'advanced_analysis': advanced_analysis})
+
+    explanations = explain_future.result()
+    publish('explanations', {'explanations': explanations})
+
+    if deepening is not None and wait_for_deepening:
+        deepening.join()
+
+    return {
+        'fen': fen,
+        'analysis_id': analysis_id,
+        'search_depth': search_depth,
+        'rendered_images': rendered_images,
+        'explanations': explanations,
+        'suggestions': serialize_suggestions(suggestions),
+        'advanced_analysis': advanced_analysis
+    }
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    prefix = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{prefix}event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def sse_response(stream):
+    # Disable proxy buffering so each event reaches the client immediately
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def read_search_options():
+    """Optional time-budgeted search and move ranking settings from the form"""
+    return {
+        'time_budget': request.form.get('time_budget', type=float),
+        'keep_deepening': request.form.get('keep_deepening', '').lower() in ('1', 'true', 'yes'),
+        'rank_all': request.form.get('rank_all', '').lower() in ('1', 'true', 'yes')
+    }
+
+def read_top_n(values, default=3):
+    """Validated `top_n` from the form, query string or JSON body; returns (top_n, error_response)"""
+    value = values.get('top_n', default)
+    try:
+        top_n = int(value)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': f'top_n must be an integer, got {value!r}'}), 400)
+    if not 1 <= top_n <= MAX_TOP_N:
+        return None, (jsonify({'error': f'top_n must be between 1 and {MAX_TOP_N}'}), 400)
+    return top_n, None
+
+def read_upload():
+    """Validate the multipart upload; returns (image_bytes, turn_code, error_response)"""
+    if 'file' not in request.files:
+        print("ERROR: No file provided")
+        return None, None, (jsonify({'error': 'No file provided'}), 400)
+
+    file = request.files['file']
+    turn = request.form.get('turn', 'White')
+
+    if file.filename == '':
+        print("ERROR: No file selected")
+        return None, None, (jsonify({'error': 'No file selected'}), 400)
+
+    print(f"Processing file: {file.filename}, turn: {turn}")
+    turn_code = 'w' if turn == 'White' else 'b'
+    return file.read(), turn_code, None
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     try:
         print("=== FLASK: Received analysis request ===")
-        
-        if 'file' not in request.files:
-            print("ERROR: No file provided")
-            return jsonify({'error': 'No file provided'}), 400
-            
-        file = request.files['file']
-        turn = request.form.get('turn', 'White')
-        
-        if file.filename == '':
-            print("ERROR: No file selected")
-            return jsonify({'error': 'No file selected'}), 400
-        
-        print(f"Processing file: {file.filename}, turn: {turn}")
-        
-        # Process the image
-        turn_code = 'w' if turn == 'White' else 'b'
-        
-        filename = secure_filename(file.filename)
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(image_path)
-        print(f"File saved to: {image_path}")
-
-        # Get FEN from image
-        print("Getting FEN from image...")
-        fen = get_fen_from_image(image_path, turn_code)
-        print(f"Generated FEN: {fen}")
-        
-        # Analyze with chess engine (original analysis)
-        print("Analyzing with chess engine...")
-        engine_path = 'stockfish/stockfish-ubuntu-x86-64-avx2'
-        suggestions, board = get_top_moves_with_analysis(fen, engine_path, top_n=3)
-        print(f"Got {len(suggestions)} suggestions")
-
-        explanations = []
-        rendered_images = []
-
-        # Process each suggestion
-        for idx, (move, pv_line, score) in enumerate(suggestions, 1):
-            print(f"Processing suggestion {idx}: move={move}, score={score}")
-            
-            image_file = f'board_{idx}.png'
-            image_out_path = os.path.join(app.config['ARTIFACTS_FOLDER'], image_file)
-            render_board_with_move(board.copy(), move, output_path=image_out_path)
-            
-            prompt = build_prompt(fen, move, pv_line, score)
-            raw_explanation = get_explanation_from_groq(prompt)
-            
-            # Parse the explanation into structured sections
-            parsed_explanation = parse_explanation(raw_explanation)
-            
-            explanations.append([move.uci(), parsed_explanation])
-            rendered_images.append(image_file)
-
-        # Save sequences
-        print("Saving sequences...")
-        simulate_and_save_sequences(board, suggestions)
-        
-        # Perform advanced analysis
-        print("Performing advanced analysis...")
-        best_move_data, all_moves_data, reasoning = perform_advanced_analysis(fen, top_n=3)
-        
-        # Prepare JSON response
-        response_data = {
-            'fen': fen,
-            'rendered_images': rendered_images,
-            'explanations': explanations,
-            'suggestions': [],
-            'advanced_analysis': {
-                'best_move': best_move_data,
-                'all_moves': all_moves_data,
-                'reasoning': reasoning
-            } if best_move_data else None
-        }
-        
-        # Handle score and pv_line conversion properly
-        for move, pv_line, score in suggestions:
-            move_uci = move.uci() if hasattr(move, 'uci') else str(move)
-            pv_line_str = convert_moves_to_string(pv_line)
-            score_value = format_score(score)
-            
-            response_data['suggestions'].append([move_uci, pv_line_str, score_value])
-        
+
+        image_data, turn_code, error = read_upload()
+        if error:
+            return error
+
+        try:
+            response_data = run_analysis_pipeline(
+                lambda event, data: None, image_data, turn_code, **read_search_options()
+            )
+        except DetectionError as e:
+            # Only a bad upload is the client's fault; anything else is a 500 below
+            print(f"ERROR: {e}")
+            return jsonify({'error': str(e)}), 400
+        except TimeoutError as e:
+            # Every engine stayed busy for the whole time budget
+            print(f"ERROR: {e}")
+            return jsonify({'error': str(e)}), 503
+
         print("=== FLASK: Analysis completed successfully ===")
         print(f"Response data keys: {list(response_data.keys())}")
         return jsonify(response_data)
@@ -198,52 +306,343 @@ def analyze():
         traceback.print_exc()
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Start an analysis in the background; progress is available via the events stream"""
+    image_data, turn_code, error = read_upload()
+    if error:
+        return error
+
+    job = job_manager.submit(
+        run_analysis_pipeline, image_data, turn_code, wait_for_deepening=True, **read_search_options()
+    )
+    print(f"=== FLASK: Submitted analysis job {job.id} ===")
+    return jsonify({
+        'job_id': job.id,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-Sent Events stream of a job's partial results (FEN, moves, explanations, ...)"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+
+    # Resume after the last event the client saw when it reconnects; a
+    # malformed id replays the stream from the start
+    start = max(request.headers.get('Last-Event-ID', -1, type=int), -1) + 1
+
+    def generate():
+        for index, event, data in job.iter_events(start):
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            yield sse_event(event, data, index)
+
+    return sse_response(generate())
+
+@app.route('/api/explain/stream', methods=['GET'])
+def stream_explanations():
+    """
+    Stream LLM explanations for the top moves of `fen` token by token over SSE.
+    Each `explanation_delta` event carries the candidate's index and move, the
+    section it belongs to and the new text; `explanation` events carry the
+    finished, fully parsed sections.
+    """
+    fen = request.args.get('fen')
+    top_n, error = read_top_n(request.args)
+    if error:
+        return error
+    if not fen:
+        return jsonify({'error': 'No FEN provided'}), 400
+    try:
+        chess.Board(fen)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid FEN: {str(e)}'}), 400
+
+    events = queue.Queue()
+
+    def run():
+        try:
+            suggestions, _ = get_top_moves_with_analysis(fen, ENGINE_PATH, top_n=top_n)
+            events.put(('moves', {'suggestions': serialize_suggestions(suggestions)}))
+            explanations = explain_moves(
+                fen, suggestions, mode='concurrent',
+                on_result=lambda idx, move_uci, explanation: events.put(
+                    ('explanation', {'index': idx, 'move': move_uci, 'explanation': explanation})
+                ),
+                on_delta=lambda idx, move_uci, section, text: events.put(
+                    ('explanation_delta', {'index': idx, 'move': move_uci, 'section': section, 'delta': text})
+                )
+            )
+            events.put(('done', {'explanations': explanations}))
+        except Exception as e:
+            print(f"Error streaming explanations: {str(e)}")
+            events.put(('error', {'error': str(e)}))
+
+    stage_executor.submit(run)
+
+    def generate():
+        while True:
+            try:
+                event, data = events.get(timeout=15)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield sse_event(event, data)
+            if event in ('done', 'error'):
+                return
+
+    return sse_response(generate())
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyze many board images in one request. Detection runs as batched YOLO
+    forward passes, engine analysis for the detected FENs runs concurrently, and
+    one JSON line per image is streamed back as soon as that image is done.
+    """
+    files = request.files.getlist('files')
+    turn = request.form.get('turn', 'White')
+    top_n, error = read_top_n(request.form)
+    if error:
+        return error
+
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    print(f"=== FLASK: Received batch analysis request for {len(files)} images ===")
+    turn_code = 'w' if turn == 'White' else 'b'
+    names = [f.filename for f in files]
+    payloads = [f.read() for f in files]
+
+    def generate():
+        futures = {}
+        try:
+            for idx, fen in iter_fens_from_uploads(payloads, turn_code):
+                if fen is None:
+                    yield json.dumps({'index': idx, 'filename': names[idx], 'error': 'Could not decode image'}) + '\n'
+                    continue
+                try:
+                    check_detected_fen(fen)
+                except DetectionError as e:
+                    yield json.dumps({'index': idx, 'filename': names[idx], 'fen': fen, 'error': str(e)}) + '\n'
+                    continue
+                futures[submit_traced(analysis_executor, analyze_fen, fen, top_n)] = (idx, fen)
+        except Exception as e:
+            print(f"Batch detection failed: {e}")
+            yield json.dumps({'error': f'Detection failed: {str(e)}'}) + '\n'
+
+        for future in as_completed(futures):
+            idx, fen = futures[future]
+            try:
+                result = {'index': idx, 'filename': names[idx], **future.result()}
+            except Exception as e:
+                print(f"Analysis failed for image {idx}: {e}")
+                result = {'index': idx, 'filename': names[idx], 'fen': fen, 'error': f'Analysis failed: {str(e)}'}
+            yield json.dumps(result) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/game', methods=['POST'])
+def analyze_game():
+    """
+    Review a whole game given as PGN or as a list of consecutive FENs. Every
+    position is analyzed on the engine pool, one JSON line per move (eval swing,
+    blunder flag, best alternative) is streamed back as soon as it is known,
+    followed by a summary line.
+    """
+    data = request.get_json(silent=True) or request.form
+    pgn = data.get('pgn')
+    if not pgn and 'file' in request.files:
+        pgn = request.files['file'].read().decode('utf-8', errors='replace')
+    fens = data.get('fens')
+    if isinstance(fens, str):
+        fens = [line.strip() for line in fens.splitlines() if line.strip()]
+    try:
+        depth = int(data.get('depth', GAME_DEPTH))
+    except (TypeError, ValueError):
+        return jsonify({'error': f"depth must be an integer, got {data.get('depth')!r}"}), 400
+    if depth < 1:
+        return jsonify({'error': 'depth must be at least 1'}), 400
+    depth = min(depth, GAME_MAX_DEPTH)
+    top_n, error = read_top_n(data, default=GAME_MULTIPV)
+    if error:
+        return error
+    # The best alternative to the move played needs a second line
+    top_n = max(2, top_n)
+
+    try:
+        boards, moves, headers = load_game(pgn=pgn, fens=fens)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    print(f"=== FLASK: Received game analysis request for {len(moves)} plies ===")
+
+    def generate():
+        yield json.dumps({'type': 'game', 'plies': len(moves), 'headers': headers, 'depth': depth}) + '\n'
+        for result in iter_game_analysis(boards, moves, depth=depth, top_n=top_n):
+            yield json.dumps(result) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def iter_stream_results(tracker, frames, top_n=3):
+    """
+    Feed frames to a live tracker and yield NDJSON lines: one per frame, plus
+    one `analysis` line whenever the position changed. Engine analysis of new
+    positions runs on the pool while later frames are being diffed.
+    """
+    pending = {}
+
+    def finished(block=False):
+        for future in (as_completed(list(pending)) if block else [f for f in list(pending) if f.done()]):
+            frame, fen = pending.pop(future)
+            try:
+                line = {'type': 'analysis', 'frame': frame, **future.result()}
+            except Exception as e:
+                print(f"Stream analysis failed for frame {frame}: {e}")
+                line = {'type': 'analysis', 'frame': frame, 'fen': fen, 'error': f'Analysis failed: {str(e)}'}
+            yield json.dumps(line) + '\n'
+
+    for img in frames:
+        if img is None:
+            yield json.dumps({'type': 'frame', 'status': 'undecodable'}) + '\n'
+            continue
+        event = tracker.process_frame(img)
+        yield json.dumps({'type': 'frame', **event}) + '\n'
+
+        if event['status'] in ('move', 'resync'):
+            board = chess.Board(event['fen'])
+            if board.is_valid() and not board.is_game_over():
+                pending[analysis_executor.submit(analyze_fen, event['fen'], top_n)] = (event['frame'], event['fen'])
+        yield from finished()
+
+    yield from finished(block=True)
+
+@app.route('/api/stream', methods=['POST'])
+def create_stream():
+    """Start following a live game; frames are then posted to the returned stream"""
+    turn = request.form.get('turn', 'White')
+    tracker = stream_registry.create('w' if turn == 'White' else 'b')
+    print(f"=== FLASK: Started live stream {tracker.id} ===")
+    return jsonify({'stream_id': tracker.id, 'frames_url': f'/api/stream/{tracker.id}/frames'}), 201
+
+@app.route('/api/stream/<stream_id>', methods=['GET', 'DELETE'])
+def stream_status(stream_id):
+    if request.method == 'DELETE':
+        if not stream_registry.remove(stream_id):
+            return jsonify({'error': f'Stream {stream_id} not found'}), 404
+        return jsonify({'status': 'ok'})
+
+    tracker = stream_registry.get(stream_id)
+    if tracker is None:
+        return jsonify({'error': f'Stream {stream_id} not found'}), 404
+    return jsonify(tracker.snapshot())
+
+@app.route('/api/stream/<stream_id>/frames', methods=['POST'])
+def post_stream_frames(stream_id):
+    """Process one or more captured frames, in order, for a live stream"""
+    files = request.files.getlist('frames') or request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No frames provided'}), 400
+    top_n, error = read_top_n(request.form)
+    if error:
+        return error
+    payloads = [f.read() for f in files]
+
+    # Frames of one stream are processed one request at a time, whichever worker gets them
+    try:
+        tracker = stream_registry.checkout(stream_id)
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 409
+    if tracker is None:
+        return jsonify({'error': f'Stream {stream_id} not found'}), 404
+
+    def generate():
+        try:
+            frames = (decode_image_bytes(data) for data in payloads)
+            yield from iter_stream_results(tracker, frames, top_n)
+        finally:
+            stream_registry.checkin(tracker)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/stream/video', methods=['POST'])
+def analyze_video():
+    """Follow the game in an uploaded screen recording, streaming moves and analyses as NDJSON"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    turn = request.form.get('turn', 'White')
+    top_n, error = read_top_n(request.form)
+    if error:
+        return error
+    stride = max(1, request.form.get('stride', STREAM_VIDEO_STRIDE, type=int))
+
+    # OpenCV can only decode video from a file
+    upload = request.files['file']
+    suffix = os.path.splitext(upload.filename or '')[1] or '.mp4'
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'wb') as f:
+        upload.save(f)
+
+    tracker = stream_registry.create('w' if turn == 'White' else 'b', checkout=True, sequential=True)
+    print(f"=== FLASK: Following video upload as stream {tracker.id} ===")
+
+    def generate():
+        try:
+            yield from iter_stream_results(tracker, iter_video_frames(path, stride), top_n)
+            yield json.dumps({'type': 'done', **tracker.snapshot()}) + '\n'
+        finally:
+            stream_registry.checkin(tracker)
+            os.remove(path)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/api/sequence/<int:move_id>', methods=['GET'])
 def get_sequence_images(move_id):
+    """
+    List the frames of a suggested line. Frames are rendered on demand when
+    they are first fetched from /static. With `?format=sheet|gif|webp` the whole
+    line is returned as a single sprite sheet or animation instead.
+    """
     try:
         print(f"Getting sequence for move {move_id}")
-        
-        # Path to sequences folder
-        sequences_folder = os.path.join(app.config['ARTIFACTS_FOLDER'], 'sequences')
-        
-        if not os.path.exists(sequences_folder):
-            print(f"Sequences folder not found: {sequences_folder}")
-            return jsonify({'error': 'Sequences folder not found'}), 404
-        
-        # Look for the move folder that matches the move_id
-        move_folder_pattern = f'move_{move_id}_'
-        move_folder = None
-        move_uci = None
-        
-        for folder_name in os.listdir(sequences_folder):
-            if folder_name.startswith(move_folder_pattern):
-                move_folder = folder_name
-                # Extract move UCI from folder name (e.g., "move_1_b7a8" -> "b7a8")
-                move_uci = folder_name.split('_', 2)[2]  # Split by '_' and take the third part
-                break
-        
-        if not move_folder:
-            print(f"Move folder for move {move_id} not found in {sequences_folder}")
-            # List available folders for debugging
-            available_folders = [f for f in os.listdir(sequences_folder) if f.startswith('move_')]
-            print(f"Available move folders: {available_folders}")
+
+        analysis_id = request.args.get('analysis_id')
+        if not analysis_id:
+            return jsonify({'error': 'analysis_id is required'}), 400
+        line = sequence_registry.get(analysis_id, move_id)
+        if line is None:
+            print(f"Move {move_id} not found in registered sequences")
             return jsonify({'error': f'Move {move_id} not found'}), 404
-        
-        # Full path to the specific move folder
-        sequence_folder = os.path.join(sequences_folder, move_folder)
-        print(f"Found sequence folder: {sequence_folder}")
-        
-        # Get all PNG files in the folder
-        sequence_images = [f for f in os.listdir(sequence_folder) if f.endswith('.png')]
-        sequence_images.sort()  # Sort by name to ensure correct order
-        
-        print(f"Found {len(sequence_images)} sequence images: {sequence_images}")
-        
+
+        fmt = request.args.get('format')
+        if fmt:
+            try:
+                path = render_sequence_animation(analysis_id, move_id, fmt)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if path is None:
+                return jsonify({'error': f'Move {move_id} has no sequence'}), 404
+            return send_artifact(path)
+
+        sequence_images = frame_names(line)
+        print(f"Found {len(sequence_images)} sequence images for {line['folder_name']}")
+
         return jsonify({
             'move_id': move_id,
-            'move_uci': move_uci,
+            'move_uci': line['move_uci'],
             'sequence_images': sequence_images,
-            'folder_name': move_folder
+            'folder_name': line['folder_name']
         })
         
     except Exception as e:
@@ -252,13 +651,93 @@ def get_sequence_images(move_id):
         traceback.print_exc()
         return jsonify({'error': f'Failed to get sequence: {str(e)}'}), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'analysis': analysis_cache.stats(),
+        'image': image_cache.stats(),
+        'artifacts': artifact_store.stats(),
+        'fast_path': fast_path.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: latency histograms, cache, engine pool and queue state"""
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({'error': 'Metrics need prometheus_client (pip install prometheus_client)'}), 501
+    body, content_type = rendered
+    return Response(body, content_type=content_type)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    """Liveness: the process is up and serving, even while still warming up"""
     return jsonify({'status': 'ok', 'message': 'Chess Vision API is running'})
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once the engine pool, detector and renderer are warm, 503 until then"""
+    snapshot = readiness.snapshot()
+    return jsonify(snapshot), 200 if snapshot['ready'] else 503
+
+@app.route('/api/model/reload', methods=['POST'])
+def reload_detector():
+    """Swap the detector weights in every worker; needs `Authorization: Bearer <ADMIN_TOKEN>`"""
+    admin_token = app.config['ADMIN_TOKEN']
+    if not admin_token:
+        return jsonify({'error': 'Model reload is disabled (ADMIN_TOKEN is not set)'}), 403
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        data = request.get_json(silent=True) or {}
+        weights = data.get('weights')
+        if not weights:
+            return jsonify({'error': 'No weights file provided'}), 400
+
+        # Only allow swapping to files inside the weights folder
+        weights_path = os.path.join(WEIGHTS_DIR, secure_filename(weights))
+        if not os.path.exists(weights_path):
+            return jsonify({'error': 'Weights file not found in the weights folder'}), 404
+
+        reload_model(weights_path)
+        return jsonify({'status': 'ok', 'models': registry.info()})
+
+    except Exception as e:
+        print(f"Error reloading model: {str(e)}")
+        return jsonify({'error': f'Failed to reload model: {str(e)}'}), 500
+
+def send_artifact(rel_path):
+    """Serve a content-addressed artifact with a hash ETag and immutable caching"""
+    response = send_from_directory(
+        os.path.abspath(app.config['ARTIFACTS_FOLDER']), rel_path,
+        etag=artifact_key(path=rel_path),
+        max_age=app.config['ARTIFACT_CACHE_SECONDS'],
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
-    return app.send_static_file(filename)
+    parts = filename.split('/')
+    if parts[0] == 'artifacts' and len(parts) > 2 and parts[1] in ('boards', 'sequences'):
+        rel_path = '/'.join(parts[1:])
+        # Sequence frames are only drawn the first time someone looks at them, and
+        # anything cleanup removed is drawn again, so handed-out URLs never go stale
+        if not artifact_store.exists(rel_path):
+            if parts[1] == 'sequences' and len(parts) == 4:
+                ensure_sequence_frame(parts[2], parts[3])
+            elif parts[1] == 'boards':
+                ensure_board_artifact(rel_path)
+        return send_artifact(rel_path)
+    return send_from_directory(os.path.abspath(app.config['STATIC_FOLDER']), filename)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    clear_published_models()
+    use_reloader = True
+    # Serve immediately and warm up alongside, except in the reloader's watcher process, which serves nothing
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        readiness.start_background_warm_up()
+    app.run(debug=True, use_reloader=use_reloader, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,75 @@
+# gunicorn.conf.py
+#
+# Production serving: gunicorn -c gunicorn.conf.py
+#
+# The master imports the app and loads the detector weights once, then forks
+# the workers, which share those pages copy-on-write. Each worker starts its
+# own Stockfish pool and runs the detector warm-up before it takes traffic.
+# Jobs, live streams and model reloads are shared between workers through
+# SQLite and a state file under cache/, so any worker can serve any request.
+
+import gc
+import os
+import sys
+
+CPU_COUNT = os.cpu_count() or 1
+
+wsgi_app = "flask_app:app"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(max(1, CPU_COUNT // 2))))
+# Threads per worker; requests spend most of their time waiting on Stockfish and the LLM
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = True
+
+# Budgeted searches, streams and batch uploads can legitimately run long
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+# Recycle workers now and then, staggered so they never all restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+# Split the CPUs between workers instead of letting every detector grab all of them
+os.environ.setdefault("DETECTOR_THREADS", str(max(1, CPU_COUNT // workers)))
+
+def on_starting(server):
+    from modules.model_registry import clear_published_models
+
+    # Weights swapped in at runtime by a previous server do not outlive it
+    clear_published_models()
+
+def when_ready(server):
+    from modules.model_registry import DEFAULT_WEIGHTS, preload_model
+    from modules.detector_backends import backend_for
+
+    # ONNX Runtime / OpenVINO sessions own thread pools that do not survive
+    # fork, so exported models are loaded in each worker instead
+    if backend_for(DEFAULT_WEIGHTS) == "torch":
+        try:
+            preload_model()
+        except Exception as e:
+            server.log.warning(f"Model preload failed: {e}")
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from touching (and so copying) objects loaded by the master
+    gc.freeze()
+
+def post_worker_init(worker):
+    from modules.startup import readiness
+
+    # Only a preloaded PyTorch model needs this; exported runtimes read DETECTOR_THREADS themselves
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(int(os.environ["DETECTOR_THREADS"]))
+
+    # A worker only accepts requests once this returns, so restarts never expose cold workers
+    readiness.warm_up_all()
+
+def worker_exit(server, worker):
+    from modules.engine_pool import shutdown_engine_pools
+    shutdown_engine_pools()
+
+def child_exit(server, worker):
+    from modules.metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -0,0 +1,164 @@
+# modules/analysis_cache.py
+
+import os
+import copy
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import chess
+import chess.engine
+
+CACHE_DB_PATH = os.getenv("ANALYSIS_CACHE_DB", "cache/analysis.sqlite3")
+CACHE_MEMORY_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "2048"))
+
+def normalize_fen(fen):
+    """
+    Reduce a FEN to the parts that determine the search result: placement, turn,
+    castling rights and a legal en passant square. Move counters are dropped.
+    """
+    board = chess.Board(fen)
+    return " ".join(board.fen(en_passant="legal").split()[:4])
+
+def serialize_score(score):
+    if score.is_mate():
+        return {"mate": score.mate()}
+    return {"cp": score.score()}
+
+def deserialize_score(data):
+    if "mate" in data:
+        return chess.engine.MateGiven if data["mate"] == 0 else chess.engine.Mate(data["mate"])
+    return chess.engine.Cp(data["cp"])
+
+def serialize_suggestions(suggestions):
+    return [
+        [move.uci(), [m.uci() for m in pv_line], serialize_score(score)]
+        for move, pv_line, score in suggestions
+    ]
+
+def deserialize_suggestions(data):
+    return [
+        (chess.Move.from_uci(move), [chess.Move.from_uci(m) for m in pv_line], deserialize_score(score))
+        for move, pv_line, score in data
+    ]
+
+class AnalysisCache:
+    """
+    Two-tier cache of analysis results: a bounded in-memory LRU in front of an
+    on-disk SQLite store. Entries are keyed by normalized FEN and a `kind`
+    ("search", "advanced", ...) and tagged with the depth and MultiPV they were
+    computed at, so a deeper/wider entry can answer a shallower/narrower request.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, max_entries=CACHE_MEMORY_SIZE):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def _connect(self):
+        if self._db is None and self.db_path:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS analysis (
+                    fen TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    multipv INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (fen, kind, depth, multipv)
+                )
+            """)
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get(self, fen, kind, depth, multipv, exact_multipv=False, with_depth=False):
+        """
+        Return a cached payload computed at >= `depth` and >= `multipv`, or None.
+        With `with_depth=True` returns `(payload, cached_depth)` instead.
+        """
+        key = (normalize_fen(fen), kind)
+
+        with self._lock:
+            for entry in self._memory.get(key, ()):
+                if entry["depth"] >= depth and self._multipv_ok(entry["multipv"], multipv, exact_multipv):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    payload = copy.deepcopy(entry["payload"])
+                    return (payload, entry["depth"]) if with_depth else payload
+
+            row = None
+            db = self._connect()
+            if db is not None:
+                op = "=" if exact_multipv else ">="
+                row = db.execute(
+                    f"SELECT depth, multipv, payload FROM analysis "
+                    f"WHERE fen = ? AND kind = ? AND depth >= ? AND multipv {op} ? "
+                    f"ORDER BY depth DESC, multipv DESC LIMIT 1",
+                    (key[0], kind, depth, multipv),
+                ).fetchone()
+
+            if row is None:
+                self.counters["misses"] += 1
+                return (None, 0) if with_depth else None
+
+            payload = json.loads(row[2])
+            self._remember(key, row[0], row[1], payload)
+            self.counters["disk_hits"] += 1
+            payload = copy.deepcopy(payload)
+            return (payload, row[0]) if with_depth else payload
+
+    def put(self, fen, kind, depth, multipv, payload):
+        key = (normalize_fen(fen), kind)
+        with self._lock:
+            self._remember(key, depth, multipv, copy.deepcopy(payload))
+            self.counters["stores"] += 1
+            db = self._connect()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?)",
+                    (key[0], kind, depth, multipv, json.dumps(payload), time.time()),
+                )
+                db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_capacity": self.max_entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM analysis")
+                db.commit()
+
+    @staticmethod
+    def _multipv_ok(cached, requested, exact):
+        return cached == requested if exact else cached >= requested
+
+    def _remember(self, key, depth, multipv, payload):
+        # Keep the deepest entries first so lookups hit the most useful one
+        entries = [e for e in self._memory.get(key, []) if (e["depth"], e["multipv"]) != (depth, multipv)]
+        entries.append({"depth": depth, "multipv": multipv, "payload": payload})
+        entries.sort(key=lambda e: (e["depth"], e["multipv"]), reverse=True)
+        self._memory[key] = entries
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+analysis_cache = AnalysisCache()
@@ -0,0 +1,202 @@
+# modules/artifact_store.py
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "static/artifacts")
+MANIFEST_DB_PATH = os.getenv("ARTIFACT_MANIFEST_DB", "cache/artifacts.sqlite3")
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_MB", "512")) * 1024 * 1024
+ARTIFACT_MAX_AGE = int(os.getenv("ARTIFACT_MAX_AGE_HOURS", "72")) * 3600
+# How long clients may cache an artifact URL. Recipes and line descriptors are
+# kept this long after last use, so every URL handed out can be re-rendered.
+ARTIFACT_CACHE_SECONDS = int(os.getenv("ARTIFACT_CACHE_DAYS", "365")) * 24 * 3600
+CLEANUP_INTERVAL = 300
+
+def artifact_key(**params):
+    """Stable content hash of everything that determines an artifact's bytes."""
+    payload = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+class ArtifactStore:
+    """
+    Content-addressed store for rendered artifacts. Files live under paths
+    derived from a hash of their inputs (FEN, move, render options), so an
+    identical board is rendered once, concurrent requests never overwrite each
+    other, and every URL is immutable. A SQLite manifest indexes files, the
+    recipes boards are rendered from and sequence line descriptors. Cleanup
+    drops files by size and age, but keeps recipes and lines for
+    `recipe_max_age`, so a dropped file is rendered again when next requested.
+    """
+
+    def __init__(self, root=ARTIFACTS_DIR, manifest_path=MANIFEST_DB_PATH,
+                 max_bytes=ARTIFACT_MAX_BYTES, max_age=ARTIFACT_MAX_AGE,
+                 recipe_max_age=ARTIFACT_CACHE_SECONDS):
+        self.root = root
+        self.manifest_path = manifest_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.recipe_max_age = recipe_max_age
+        self._lock = threading.Lock()
+        self._db = None
+        self._last_cleanup = time.time()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.manifest_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS lines (
+                    id TEXT PRIMARY KEY,
+                    meta TEXT NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS recipes (
+                    path TEXT PRIMARY KEY,
+                    meta TEXT NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            db.commit()
+            self._db = db
+        return self._db
+
+    def abspath(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def get_or_create(self, rel_path, render_fn, recipe=None):
+        """
+        Return `rel_path`, calling `render_fn(tmp_path)` to produce it first if
+        it does not exist. Files are written to a temp name and moved into place
+        atomically, so concurrent renders of the same artifact are harmless.
+        `recipe` (JSON-serializable) is recorded so the file can be rendered
+        again after cleanup; see `get_recipe`.
+        """
+        path = self.abspath(rel_path)
+        now = time.time()
+
+        if recipe is not None:
+            with self._lock:
+                db = self._connect()
+                db.execute("INSERT OR REPLACE INTO recipes VALUES (?, ?, ?)", (rel_path, json.dumps(recipe), now))
+                db.commit()
+
+        if os.path.exists(path):
+            with self._lock:
+                self._connect().execute("UPDATE files SET accessed = ? WHERE path = ?", (now, rel_path))
+                self._connect().commit()
+            return rel_path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+        try:
+            render_fn(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (rel_path, os.path.getsize(path), now, now),
+            )
+            db.commit()
+
+        self.maybe_cleanup()
+        return rel_path
+
+    def exists(self, rel_path):
+        return os.path.exists(self.abspath(rel_path))
+
+    def put_line(self, line_id, meta):
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO lines VALUES (?, ?, ?)", (line_id, json.dumps(meta), time.time()))
+            db.commit()
+
+    def get_line(self, line_id):
+        return self._get_meta("lines", "id", line_id)
+
+    def get_recipe(self, rel_path):
+        """The recipe recorded for `rel_path` by `get_or_create`, or None."""
+        return self._get_meta("recipes", "path", rel_path)
+
+    def _get_meta(self, table, column, key):
+        # Reading counts as use: it keeps the record alive for another `recipe_max_age`
+        with self._lock:
+            db = self._connect()
+            row = db.execute(f"SELECT meta FROM {table} WHERE {column} = ?", (key,)).fetchone()
+            if row is not None:
+                db.execute(f"UPDATE {table} SET accessed = ? WHERE {column} = ?", (time.time(), key))
+                db.commit()
+        return json.loads(row[0]) if row else None
+
+    def maybe_cleanup(self):
+        if time.time() - self._last_cleanup >= CLEANUP_INTERVAL:
+            self.cleanup()
+
+    def cleanup(self):
+        """
+        Drop artifacts not accessed within `max_age`, then the least recently
+        used until under `max_bytes`. Recipes and lines not used within
+        `recipe_max_age` go too.
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            self._last_cleanup = now
+            db = self._connect()
+            cutoff = now - self.max_age
+            expired = [row[0] for row in db.execute("SELECT path FROM files WHERE accessed < ?", (cutoff,))]
+
+            total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM files WHERE accessed >= ?", (cutoff,)).fetchone()[0]
+            if total > self.max_bytes:
+                for path, size in db.execute(
+                    "SELECT path, bytes FROM files WHERE accessed >= ? ORDER BY accessed ASC", (cutoff,)
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    expired.append(path)
+                    total -= size
+
+            for rel_path in expired:
+                try:
+                    os.remove(self.abspath(rel_path))
+                except FileNotFoundError:
+                    pass
+                db.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+                removed += 1
+
+            recipe_cutoff = now - self.recipe_max_age
+            db.execute("DELETE FROM lines WHERE accessed < ?", (recipe_cutoff,))
+            db.execute("DELETE FROM recipes WHERE accessed < ?", (recipe_cutoff,))
+            db.commit()
+
+        if removed:
+            print(f"Artifact cleanup removed {removed} files")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            count, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM files").fetchone()
+        return {"files": count, "bytes": total, "max_bytes": self.max_bytes}
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,366 @@
+# modules/benchmark.py
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import chess
+
+# Clients sending requests at the same time, one run per level
+BENCH_CONCURRENCY = [int(n) for n in os.getenv("BENCH_CONCURRENCY", "1,4").split(",")]
+# Timed passes over the corpus per concurrency level, after one untimed warm-up pass
+BENCH_ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+# Node cap per search so engine results are the same on every machine; 0 runs the normal depth-only search
+BENCH_NODES = int(os.getenv("BENCH_NODES", "200000"))
+# Fixed response time of the stand-in LLM
+BENCH_LLM_LATENCY_MS = int(os.getenv("BENCH_LLM_LATENCY_MS", "300"))
+# "1" keeps caches between rounds (measures the cached path); by default every round starts cold
+BENCH_WARM_CACHES = os.getenv("BENCH_WARM_CACHES", "0") == "1"
+# Optional folder of real screenshots added to the rendered corpus
+BENCH_IMAGES_DIR = os.getenv("BENCH_IMAGES_DIR")
+BENCH_RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", "cache/benchmarks")
+# `compare` fails when a tracked percentile gets slower by more than this
+BENCH_REGRESSION_PCT = float(os.getenv("BENCH_REGRESSION_PCT", "10"))
+
+# Fixed positions; each is rendered to a board image so detection is part of the run
+CORPUS = [
+    ("opening", "italian", "r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3"),
+    ("opening", "sicilian", "rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2"),
+    ("opening", "queens_gambit", "rnbqkbnr/ppp1pppp/8/3p4/2PP4/8/PP2PPPP/RNBQKBNR b KQkq - 0 2"),
+    ("opening", "kings_indian", "rnbq1rk1/ppp1ppbp/3p1np1/8/2PPP3/2N2N2/PP3PPP/R1BQKB1R b KQ - 1 5"),
+    ("middlegame", "carlsbad", "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9"),
+    ("middlegame", "open_center", "r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 11"),
+    ("middlegame", "kingside_attack", "r1b2rk1/pp1nqppp/2p1p3/3pP3/3P1P2/2NB4/PPPQ2PP/R4RK1 w - - 0 12"),
+    ("middlegame", "tactics", "r1b1k2r/ppppqppp/2n2n2/2b1p3/2B1P3/2NP1N2/PPP2PPP/R1BQK2R w KQkq - 4 6"),
+    ("endgame", "rook_pawns", "8/5pk1/6p1/7p/7P/6P1/5PK1/r7 w - - 0 40"),
+    ("endgame", "lucena", "1K1k4/1P6/8/8/8/8/r7/2R5 w - - 0 1"),
+    ("endgame", "minor_pieces", "8/4kp2/4p3/2b1P1p1/6P1/3B1K2/8/8 w - - 0 45"),
+    ("endgame", "queen_vs_pawns", "8/8/8/8/1k6/8/1p6/3K3Q w - - 0 60"),
+]
+
+STUB_EXPLANATION = (
+    "1. **Best Move Explanation**: The move improves the position of a piece and keeps the initiative.\n"
+    "2. **Strategic Idea**: Increase control of the center and prepare to activate the remaining pieces.\n"
+    "3. **Tactical Motif**: It keeps pressure on a loose piece so the opponent has to defend it."
+)
+
+class _StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.server.latency)
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+
+        if body.get("response_format", {}).get("type") == "json_object":
+            moves = [line.split(" | ")[0].split("Move ", 1)[1] for line in prompt.splitlines() if " | " in line]
+            content = json.dumps({"moves": [{
+                "move": move,
+                "best_move_explanation": "The move improves the position of a piece.",
+                "strategic_idea": "Increase control of the center.",
+                "tactical_motif": "It keeps pressure on a loose piece.",
+            } for move in moves]})
+        else:
+            content = STUB_EXPLANATION
+
+        completion = {"id": "bench", "created": int(time.time()), "model": body.get("model", "stub")}
+        if body.get("stream"):
+            events = [{**completion, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": {"role": "assistant", "content": word + " "}, "finish_reason": None}
+            ]} for word in content.split(" ")]
+            events.append({**completion, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": {}, "finish_reason": "stop"}
+            ]})
+            payload = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+            self._reply(payload.encode("utf-8"), "text/event-stream")
+        else:
+            completion.update(object="chat.completion", choices=[{
+                "index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"
+            }], usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+            self._reply(json.dumps(completion).encode("utf-8"), "application/json")
+
+    def _reply(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class StubLLMServer:
+    """
+    Local stand-in for the Groq chat completions API (plain, streamed and JSON
+    mode) with a fixed response time, so explanation timings do not depend on
+    the network or on the model's mood. Point GROQ_BASE_URL at `url`.
+    """
+
+    def __init__(self, latency_ms=BENCH_LLM_LATENCY_MS):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubLLMHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency_ms / 1000
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+def percentile(values, q):
+    """Linearly interpolated `q`-th percentile of `values`."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def summarize(seconds):
+    """p50/p95/p99/mean/max in milliseconds."""
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50": round(percentile(ms, 50), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "mean": round(sum(ms) / len(ms), 2),
+        "max": round(max(ms), 2),
+    }
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_corpus(images_dir=BENCH_IMAGES_DIR):
+    """`(phase, name, fen, image_bytes)` for every corpus position, plus any screenshots in `images_dir`."""
+    from modules.board_renderer import get_renderer
+
+    renderer = get_renderer()
+    corpus = [(phase, name, fen, renderer.render_png(chess.Board(fen))) for phase, name, fen in CORPUS]
+    if images_dir:
+        for filename in sorted(os.listdir(images_dir)):
+            with open(os.path.join(images_dir, filename), "rb") as f:
+                corpus.append(("screenshot", filename, None, f.read()))
+    return corpus
+
+def reset_caches():
+    """Empty every cache a request can hit, so the next request takes the full path."""
+    from modules.analysis_cache import analysis_cache
+    from modules.image_to_fen import image_cache
+    from modules.artifact_store import artifact_store
+
+    analysis_cache.clear()
+    image_cache.clear()
+    shutil.rmtree(artifact_store.root, ignore_errors=True)
+
+def run_request(item):
+    """One full pipeline run; returns its wall time, stage spans and result."""
+    from flask_app import run_analysis_pipeline
+    from modules.metrics import RequestTimer
+
+    phase, name, fen, image = item
+    # Screenshots carry no side to move; analyse them for White
+    turn_code = "b" if fen and chess.Board(fen).turn == chess.BLACK else "w"
+    timer = RequestTimer(f"benchmark {name}")
+    try:
+        result = run_analysis_pipeline(lambda event, data: None, image, turn_code)
+        status = 200
+    except Exception as e:
+        result = {"error": str(e)}
+        status = 500
+    seconds = timer.finish("benchmark", "RUN", status)
+    return seconds, list(timer.trace.spans), result
+
+def run_level(corpus, clients, rounds, warm):
+    """Timed rounds over the corpus with `clients` concurrent clients."""
+    latencies, stages, errors = [], {}, 0
+    wall = 0.0
+    best_moves = {}
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for _ in range(rounds):
+            if not warm:
+                reset_caches()
+            start = time.perf_counter()
+            outcomes = list(executor.map(run_request, corpus))
+            wall += time.perf_counter() - start
+
+            for (phase, name, _, _), (seconds, spans, result) in zip(corpus, outcomes):
+                latencies.append(seconds)
+                for stage, _, stage_seconds in spans:
+                    stages.setdefault(stage, []).append(stage_seconds)
+                if "error" in result:
+                    errors += 1
+                elif result["suggestions"]:
+                    best_moves[name] = {"fen": result["fen"], "move": result["suggestions"][0][0]}
+
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "end_to_end": summarize(latencies),
+        "stages": {stage: summarize(seconds) for stage, seconds in sorted(stages.items())},
+        "best_moves": best_moves,
+    }
+
+def configure_environment(workdir, llm_url, nodes):
+    """Point caches, artifacts and the LLM at throwaway locations before the app modules are imported."""
+    if any(name in sys.modules for name in ("flask_app", "modules.analysis_cache", "modules.groq_explainer")):
+        raise RuntimeError("configure the benchmark before importing the app")
+    os.environ["ANALYSIS_CACHE_DB"] = os.path.join(workdir, "analysis.sqlite3")
+    os.environ["ARTIFACT_MANIFEST_DB"] = os.path.join(workdir, "artifacts.sqlite3")
+    os.environ["ARTIFACTS_DIR"] = os.path.join(workdir, "artifacts")
+    os.environ["GROQ_BASE_URL"] = llm_url
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ["ENGINE_NODES"] = str(nodes)
+    # Book and tablebase hits would skip the engine; the corpus measures the search
+    os.environ["OPENING_BOOK"] = ""
+    os.environ["SYZYGY_PATH"] = ""
+
+def run_benchmark(output_path=None, concurrency=BENCH_CONCURRENCY, rounds=BENCH_ROUNDS, nodes=BENCH_NODES,
+                  llm_latency_ms=BENCH_LLM_LATENCY_MS, warm=BENCH_WARM_CACHES):
+    """
+    Run the corpus through the full analysis pipeline (detection, engine search,
+    rendering, explanations against a stand-in LLM, advanced analysis) at each
+    concurrency level and write the results as JSON. Returns the results.
+    """
+    with tempfile.TemporaryDirectory(prefix="chessv-bench-") as workdir, StubLLMServer(llm_latency_ms) as llm:
+        configure_environment(workdir, llm.url, nodes)
+        from modules.startup import readiness
+        from modules.engine_pool import ENGINE_PATH, ENGINE_THREADS, ENGINE_POOL_SIZE, shutdown_engine_pools
+        from modules.model_registry import registry
+
+        corpus = build_corpus()
+        # App logging goes nowhere while timing; terminal output would skew the numbers
+        with contextlib.redirect_stdout(io.StringIO()):
+            readiness.warm_up_all()
+            run_level(corpus, 1, 1, warm)
+        print(f"Warm-up done; {len(corpus)} positions, {rounds} round(s) per level")
+
+        levels = []
+        for clients in concurrency:
+            with contextlib.redirect_stdout(io.StringIO()):
+                level = run_level(corpus, clients, rounds, warm)
+            levels.append(level)
+            e2e = level["end_to_end"]
+            print(f"{clients:>3} client(s): {level['throughput_rps']:.2f} req/s, "
+                  f"p50 {e2e['p50']:.0f} ms, p95 {e2e['p95']:.0f} ms, p99 {e2e['p99']:.0f} ms, "
+                  f"{level['errors']} error(s)")
+
+        detector = registry.info()
+        shutdown_engine_pools()
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "rounds": rounds,
+            "nodes": nodes,
+            "llm_latency_ms": llm_latency_ms,
+            "warm_caches": warm,
+            "engine": os.path.basename(ENGINE_PATH),
+            "engine_threads": ENGINE_THREADS,
+            "engine_pool_size": ENGINE_POOL_SIZE,
+            "detector": detector,
+            "corpus": [f"{phase}/{name}" for phase, name, _, _ in corpus],
+        },
+        "levels": levels,
+        "peak_rss_mb": peak_rss_mb(),
+        # Engine processes, counted once they have exited
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    print(f"Peak RSS: {results['peak_rss_mb']} MB (engines: {results['children_peak_rss_mb']} MB)")
+
+    if output_path is None:
+        os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output_path = os.path.join(BENCH_RESULTS_DIR, f"{stamp}-{results['revision'] or 'local'}.json")
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+    return results
+
+def compare_results(base_path, new_path, threshold_pct=BENCH_REGRESSION_PCT):
+    """
+    Print percentile changes between two result files, level by level and
+    stage by stage. Returns False if anything got slower by more than
+    `threshold_pct`, or if fixed-node runs picked different best moves.
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base.get('revision')} -> {new.get('revision')}")
+
+    ok = True
+    base_levels = {level["clients"]: level for level in base["levels"]}
+    for level in new["levels"]:
+        old = base_levels.get(level["clients"])
+        if old is None:
+            continue
+        print(f"{level['clients']} client(s): {old['throughput_rps']:.2f} -> {level['throughput_rps']:.2f} req/s")
+        rows = [("end_to_end", old["end_to_end"], level["end_to_end"])]
+        rows += [(stage, old["stages"][stage], stats)
+                 for stage, stats in level["stages"].items() if stage in old["stages"]]
+        for name, before, after in rows:
+            changes = []
+            for p in ("p50", "p95", "p99"):
+                change = (after[p] - before[p]) / before[p] * 100 if before[p] else 0.0
+                flag = ""
+                # Sub-millisecond stages jitter by large percentages; ignore changes under 1 ms
+                if change > threshold_pct and after[p] - before[p] >= 1:
+                    flag, ok = " !", False
+                changes.append(f"{p} {before[p]:.0f}->{after[p]:.0f} ms ({change:+.0f}%){flag}")
+            print(f"  {name:<20} " + "  ".join(changes))
+
+        if base["config"]["nodes"] and base["config"]["nodes"] == new["config"]["nodes"]:
+            for name, move in level["best_moves"].items():
+                before = old["best_moves"].get(name)
+                if before is not None and before != move:
+                    print(f"  best move changed for {name}: {before['move']} -> {move['move']}")
+                    ok = False
+
+    print(f"Peak RSS: {base['peak_rss_mb']} -> {new['peak_rss_mb']} MB")
+    return ok
+
+if __name__ == '__main__':
+    # python -m modules.benchmark run [output.json]
+    # python -m modules.benchmark compare <base.json> <new.json>  -- exits non-zero on a regression
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "run":
+        run_benchmark(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "compare" and len(sys.argv) > 3:
+        sys.exit(0 if compare_results(sys.argv[2], sys.argv[3]) else 1)
+    else:
+        print("usage: python -m modules.benchmark run [output.json]")
+        print("       python -m modules.benchmark compare <base.json> <new.json>")
@@ -0,0 +1,180 @@
+# modules/board_renderer.py
+
+import io
+import math
+import time
+import threading
+import numpy as np
+import chess
+import chess.svg
+from PIL import Image, ImageDraw, ImageFont
+
+BOARD_SIZE = 390
+MARGIN = 15
+PNG_COMPRESS_LEVEL = 1
+
+# Colours follow chess.svg defaults so both renderers produce the same look
+COLORS = {
+    "square light": (0xff, 0xce, 0x9e),
+    "square dark": (0xd1, 0x8b, 0x47),
+    "square light lastmove": (0xcd, 0xd1, 0x6a),
+    "square dark lastmove": (0xaa, 0xa2, 0x3b),
+    "margin": (0x21, 0x21, 0x21),
+    "coord": (0xe5, 0xe5, 0xe5),
+    "arrow": (0x15, 0x78, 0x1b, 0x80),
+}
+
+class SpriteBoardRenderer:
+    """
+    Raster board renderer that rasterizes the board and piece tiles once for a
+    given size and builds every frame by NumPy alpha compositing, instead of
+    building and rasterizing a full SVG per frame.
+    """
+
+    def __init__(self, size=BOARD_SIZE, margin=MARGIN):
+        self.size = size
+        self.margin = margin
+        self.square = (size - 2 * margin) // 8
+        self._base = self._build_base()
+        self._sprites = self._build_sprites()
+
+    def _square_origin(self, square, flipped=False):
+        file, rank = chess.square_file(square), chess.square_rank(square)
+        if flipped:
+            file, rank = 7 - file, 7 - rank
+        return self.margin + file * self.square, self.margin + (7 - rank) * self.square
+
+    def _build_base(self):
+        base = np.empty((self.size, self.size, 3), dtype=np.uint8)
+        base[:] = COLORS["margin"]
+
+        for square in chess.SQUARES:
+            x, y = self._square_origin(square)
+            light = (chess.square_file(square) + chess.square_rank(square)) % 2 == 1
+            base[y:y + self.square, x:x + self.square] = COLORS["square light" if light else "square dark"]
+
+        if self.margin:
+            image = Image.fromarray(base)
+            draw = ImageDraw.Draw(image)
+            font = ImageFont.load_default()
+            for i in range(8):
+                offset = self.margin + i * self.square + self.square // 2
+                for y in (self.margin // 2, self.size - self.margin // 2):
+                    draw.text((offset, y), chess.FILE_NAMES[i], fill=COLORS["coord"], font=font, anchor="mm")
+                for x in (self.margin // 2, self.size - self.margin // 2):
+                    draw.text((x, offset), chess.RANK_NAMES[7 - i], fill=COLORS["coord"], font=font, anchor="mm")
+            base = np.asarray(image).copy()
+
+        return base
+
+    def _build_sprites(self):
+        # Needed once per renderer size, not at import time
+        import cairosvg
+
+        sprites = {}
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                piece = chess.Piece(piece_type, color)
+                svg = chess.svg.piece(piece, size=self.square)
+                png = cairosvg.svg2png(bytestring=svg.encode('utf-8'),
+                                       output_width=self.square, output_height=self.square)
+                rgba = np.asarray(Image.open(io.BytesIO(png)).convert("RGBA"), dtype=np.float32)
+                alpha = rgba[..., 3:4] / 255.0
+                # Premultiplied colour plus (1 - alpha) so compositing is one multiply-add
+                sprites[piece.symbol()] = (rgba[..., :3] * alpha, 1.0 - alpha)
+        return sprites
+
+    def render(self, board, move=None, flipped=False):
+        """Render `board` (with `move` as arrow and last-move highlight) to a PIL image."""
+        frame = self._base.copy()
+
+        if move is not None:
+            for square in (move.from_square, move.to_square):
+                x, y = self._square_origin(square, flipped)
+                light = (chess.square_file(square) + chess.square_rank(square)) % 2 == 1
+                frame[y:y + self.square, x:x + self.square] = COLORS["square light lastmove" if light else "square dark lastmove"]
+
+        for square, piece in board.piece_map().items():
+            x, y = self._square_origin(square, flipped)
+            src, inv_alpha = self._sprites[piece.symbol()]
+            tile = frame[y:y + self.square, x:x + self.square]
+            tile[:] = (tile * inv_alpha + src).astype(np.uint8)
+
+        image = Image.fromarray(frame)
+        if move is not None and move.from_square != move.to_square:
+            image = self._draw_arrow(image, move, flipped)
+        return image
+
+    def _draw_arrow(self, image, move, flipped):
+        half = self.square / 2
+        fx, fy = self._square_origin(move.from_square, flipped)
+        tx, ty = self._square_origin(move.to_square, flipped)
+        fx, fy, tx, ty = fx + half, fy + half, tx + half, ty + half
+
+        dx, dy = tx - fx, ty - fy
+        length = math.hypot(dx, dy)
+        ux, uy = dx / length, dy / length
+        head_len = self.square * 0.45
+        head_width = self.square * 0.35
+        shaft_width = max(1, int(self.square * 0.2))
+        bx, by = tx - ux * head_len, ty - uy * head_len
+
+        overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        draw.line([(fx, fy), (bx, by)], fill=COLORS["arrow"], width=shaft_width)
+        draw.polygon([
+            (tx, ty),
+            (bx - uy * head_width, by + ux * head_width),
+            (bx + uy * head_width, by - ux * head_width),
+        ], fill=COLORS["arrow"])
+
+        return Image.alpha_composite(image.convert("RGBA"), overlay).convert("RGB")
+
+    def render_png(self, board, move=None, output_path=None, flipped=False):
+        """Render to PNG; writes to `output_path` if given, otherwise returns the bytes."""
+        image = self.render(board, move, flipped)
+        # Low zlib effort: encoding dominates frame time and the size difference is small
+        if output_path is not None:
+            image.save(output_path, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+            return output_path
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return buffer.getvalue()
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+def get_renderer(size=BOARD_SIZE):
+    """Return the shared renderer for `size`, building its tiles on first use."""
+    with _renderers_lock:
+        renderer = _renderers.get(size)
+        if renderer is None:
+            renderer = SpriteBoardRenderer(size)
+            _renderers[size] = renderer
+        return renderer
+
+def benchmark(frames=60):
+    """Compare per-frame cost of the sprite renderer against the SVG + cairosvg path."""
+    import cairosvg
+
+    board = chess.Board("r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9")
+    move = chess.Move.from_uci("c4d5")
+    renderer = get_renderer()
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        svg = chess.svg.board(board, arrows=[(move.from_square, move.to_square)], lastmove=move)
+        cairosvg.svg2png(bytestring=svg.encode('utf-8'))
+    svg_ms = (time.perf_counter() - start) * 1000 / frames
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        renderer.render_png(board, move)
+    sprite_ms = (time.perf_counter() - start) * 1000 / frames
+
+    print(f"SVG + cairosvg: {svg_ms:.2f} ms/frame")
+    print(f"Sprite compositing: {sprite_ms:.2f} ms/frame (speedup {svg_ms / sprite_ms:.1f}x)")
+    return {"svg_ms": svg_ms, "sprite_ms": sprite_ms}
+
+if __name__ == '__main__':
+    benchmark()
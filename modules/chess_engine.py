@@ -1,15 +1,49 @@
+import os
+import time
+import threading
 import chess
 import chess.engine
 import chess.svg
-import cairosvg
-from IPython.display import display, Image
+from modules.engine_pool import get_engine_pool, search_limit
+from modules.board_renderer import BOARD_SIZE, get_renderer
+from modules.artifact_store import artifact_store, artifact_key
+from modules.analysis_cache import analysis_cache, serialize_suggestions, deserialize_suggestions
+from modules.fast_path import probe_fast_path
 
-def get_top_moves_with_analysis(fen, engine_path="stockfish", depth=20, top_n=3):
+# Budgeted searches accept a cached answer only if it is at least this deep
+BUDGET_CACHE_MIN_DEPTH = int(os.getenv("BUDGET_CACHE_MIN_DEPTH", "18"))
+# How far a budgeted search keeps deepening in the background when asked to
+BACKGROUND_DEPTH = int(os.getenv("BACKGROUND_DEPTH", "24"))
+# ...and for at most this many seconds; it also stops as soon as another request needs an engine
+BACKGROUND_SECONDS = float(os.getenv("BACKGROUND_SECONDS", "10"))
+# Extra time past the budget allowed for the first complete iteration before giving up
+BUDGET_GRACE_SECONDS = float(os.getenv("BUDGET_GRACE_SECONDS", "0.5"))
+
+def get_top_moves_with_analysis(fen, engine_path="stockfish", depth=20, top_n=3, use_cache=True, use_fast_path=True,
+                                engine=None):
+    """
+    MultiPV search of `fen`; returns `(suggestions, board)`. Pass a checked-out
+    `engine` to search on it instead of the pool, e.g. to keep one engine (and
+    its hash table) across consecutive positions of a game.
+    """
     board = chess.Board(fen)
-    engine = chess.engine.SimpleEngine.popen_uci(engine_path)
 
-    # Get top N best moves
-    infos = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=top_n)
+    # Book moves and tablebase results are instant and exact enough to skip the search
+    if use_fast_path:
+        suggestions = probe_fast_path(board, top_n)
+        if suggestions:
+            return suggestions, board
+
+    if use_cache:
+        cached = analysis_cache.get(fen, "search", depth, top_n)
+        if cached is not None:
+            return deserialize_suggestions(cached)[:top_n], board
+
+    # Get top N best moves on a pooled, already-running engine
+    if engine is not None:
+        infos = engine.analyse(board, search_limit(depth), multipv=top_n)
+    else:
+        infos = get_engine_pool(engine_path).analyse(board, search_limit(depth), multipv=top_n)
 
     suggestions = []
     for info in infos:
@@ -18,10 +52,176 @@ def get_top_moves_with_analysis(fen, engine_path="stockfish", depth=20, top_n=3)
         score = info['score'].relative
         suggestions.append((best_move, pv_line, score))
 
-    engine.quit()
+    if use_cache:
+        analysis_cache.put(fen, "search", depth, top_n, serialize_suggestions(suggestions))
     return suggestions, board
 
-def render_board_with_move(board, move, output_path="artifacts/board.png"):
+def _info_to_suggestion(info):
+    return info['pv'][0], info['pv'], info['score'].relative
+
+def iter_completed_depths(analysis, board, top_n):
+    """
+    Yield `(depth, suggestions)` from a streaming `engine.analysis()` every time
+    all MultiPV lines have been reported at the same depth, so each snapshot is
+    a consistent ranking rather than a mix of depths.
+    """
+    lines = min(top_n, board.legal_moves.count())
+    latest = {}
+    for info in analysis:
+        if not info.get('pv') or 'score' not in info or 'depth' not in info:
+            continue
+        latest[info.get('multipv', 1)] = info
+        depths = {latest[k]['depth'] for k in latest}
+        if len(latest) >= lines and len(depths) == 1:
+            yield info['depth'], [_info_to_suggestion(latest[k]) for k in sorted(latest)][:lines]
+
+def get_top_moves_within_budget(fen, engine_path="stockfish", time_budget=1.0, top_n=3, max_depth=None,
+                                keep_deepening=False, on_update=None, use_cache=True, use_fast_path=True):
+    """
+    Iteratively deepening MultiPV search bounded by wall-clock time. Returns
+    `(suggestions, board, depth, deepening)`: the best complete MultiPV result
+    available when `time_budget` seconds ran out and the depth it reached.
+    Waiting for a free engine counts against the budget. If no engine frees
+    up in time, or not even one iteration completes within the budget plus
+    BUDGET_GRACE_SECONDS, a cached result of any depth is returned, or
+    TimeoutError raised. Engine failures are raised, never returned as an
+    empty result.
+
+    With `keep_deepening=True` the same engine keeps searching (up to
+    BACKGROUND_DEPTH, for at most BACKGROUND_SECONDS, and only while no other
+    request is waiting for an engine) after returning; `on_update(suggestions,
+    depth)` is called for every deeper result and the final one is cached.
+    `deepening` is that background thread (or None) so callers can wait on it.
+    Book and tablebase answers are returned with depth 0.
+    """
+    started = time.monotonic()
+    board = chess.Board(fen)
+
+    if use_fast_path:
+        suggestions = probe_fast_path(board, top_n)
+        if suggestions:
+            return suggestions, board, 0, None
+
+    if use_cache:
+        cached, cached_depth = analysis_cache.get(fen, "search", BUDGET_CACHE_MIN_DEPTH, top_n, with_depth=True)
+        if cached is not None:
+            return deserialize_suggestions(cached)[:top_n], board, cached_depth, None
+
+    if board.is_game_over():
+        return [], board, 0, None
+
+    def fall_back(reason):
+        # A shallower cached answer beats blowing the budget
+        cached, cached_depth = analysis_cache.get(fen, "search", 1, top_n, with_depth=True) if use_cache else (None, 0)
+        if cached is not None:
+            return deserialize_suggestions(cached)[:top_n], board, cached_depth, None
+        raise TimeoutError(reason)
+
+    pool = get_engine_pool(engine_path)
+    try:
+        engine = pool.acquire(timeout=time_budget)
+    except TimeoutError:
+        return fall_back(f"No engine became free within the {time_budget}s budget")
+    lock = threading.Lock()
+    first_result = threading.Event()
+    state = {"depth": 0, "suggestions": [], "returned": False, "cancelled": False, "analysis": None, "error": None}
+    target_depth = BACKGROUND_DEPTH if keep_deepening else max_depth
+
+    def search():
+        broken = False
+        try:
+            if keep_deepening:
+                limit = chess.engine.Limit(depth=target_depth, time=time_budget + BACKGROUND_SECONDS)
+            else:
+                limit = chess.engine.Limit(depth=target_depth) if target_depth else None
+            with engine.analysis(board, limit, multipv=top_n) as analysis:
+                with lock:
+                    state["analysis"] = analysis
+                    if state["cancelled"]:
+                        analysis.stop()
+                for depth, suggestions in iter_completed_depths(analysis, board, top_n):
+                    with lock:
+                        state["depth"], state["suggestions"] = depth, suggestions
+                        returned, cancelled = state["returned"], state["cancelled"]
+                    first_result.set()
+                    if cancelled:
+                        break
+                    if returned and on_update:
+                        on_update(suggestions, depth)
+                    # Background deepening is a bonus; give the engine up to anyone waiting for it
+                    if returned and pool.stats()["waiting"]:
+                        break
+        except (chess.engine.EngineTerminatedError, chess.engine.EngineError) as e:
+            print(f"Budgeted search failed, replacing the engine: {e}")
+            broken = True
+            state["error"] = e
+        except Exception as e:
+            print(f"Budgeted search failed: {e}")
+            state["error"] = e
+        finally:
+            pool.release(engine, broken=broken)
+            first_result.set()
+
+        if use_cache and state["suggestions"]:
+            analysis_cache.put(fen, "search", state["depth"], top_n, serialize_suggestions(state["suggestions"]))
+
+    thread = threading.Thread(target=search, name="budgeted-search", daemon=True)
+    thread.start()
+
+    thread.join(max(0.0, time_budget - (time.monotonic() - started)))
+    # Hand back at least one complete iteration, even on tiny budgets, but not at any cost
+    first_result.wait(max(0.0, time_budget - (time.monotonic() - started)) + BUDGET_GRACE_SECONDS)
+    with lock:
+        state["returned"] = True
+        suggestions, depth, analysis, error = state["suggestions"], state["depth"], state["analysis"], state["error"]
+        if not suggestions:
+            state["cancelled"] = True
+
+    if not suggestions:
+        if analysis is not None and thread.is_alive():
+            analysis.stop()
+        if error is not None:
+            raise error
+        return fall_back(f"No complete search iteration within the {time_budget}s budget")
+
+    if keep_deepening and thread.is_alive():
+        return suggestions, board, depth, thread
+
+    if analysis is not None and thread.is_alive():
+        analysis.stop()
+    thread.join()
+    return suggestions, board, depth, None
+
+def render_board_with_move(board, move, output_path="artifacts/board.png", renderer="sprite"):
+    if renderer == "svg":
+        return render_board_with_move_svg(board, move, output_path)
+    # Pre-rasterized tiles composited per frame; no SVG build or cairosvg call
+    get_renderer().render_png(board, move, output_path=output_path)
+
+def render_board_artifact(board, move, renderer="sprite"):
+    """Render into the content-addressed artifact store; returns the path relative to the artifacts folder."""
+    key = artifact_key(kind="board", fen=board.fen(), move=move.uci(), renderer=renderer, size=BOARD_SIZE)
+    board = board.copy()
+    return artifact_store.get_or_create(
+        f"boards/{key[:2]}/{key}.png",
+        lambda path: render_board_with_move(board, move, output_path=path, renderer=renderer),
+        recipe={"fen": board.fen(), "move": move.uci(), "renderer": renderer},
+    )
+
+def ensure_board_artifact(rel_path):
+    """Render a board artifact again if cleanup removed its file. Returns its relative path or None."""
+    recipe = artifact_store.get_recipe(rel_path)
+    if recipe is None:
+        return None
+    rendered = render_board_artifact(chess.Board(recipe["fen"]), chess.Move.from_uci(recipe["move"]), recipe["renderer"])
+    # Render settings that changed since (e.g. BOARD_SIZE) give the board a new path
+    return rendered if rendered == rel_path else None
+
+def render_board_with_move_svg(board, move, output_path="artifacts/board.png"):
+    # Only this legacy path and notebooks need these; keep them off the import path
+    import cairosvg
+    from IPython.display import display, Image
+
     svg_board = chess.svg.board(board, arrows=[(move.from_square, move.to_square)], lastmove=move)
     cairosvg.svg2png(bytestring=svg_board.encode('utf-8'), write_to=output_path)
 
@@ -0,0 +1,274 @@
+# modules/detector_backends.py
+
+import os
+import sys
+import glob
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+
+DETECTOR_THREADS = int(os.getenv("DETECTOR_THREADS", str(os.cpu_count() or 1)))
+DEFAULT_IMGSZ = 640
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+STRIDE = 32
+
+class Boxes:
+    """Minimal stand-in for `ultralytics` Boxes backed by NumPy arrays."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+class Detections:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+def letterbox(img, imgsz):
+    """Resize keeping aspect ratio and pad to a square `imgsz`, like the YOLO preprocessor."""
+    import cv2
+    h, w = img.shape[:2]
+    gain = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_x, pad_y = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR) if (new_w, new_h) != (w, h) else img
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, gain, (left, top)
+
+def postprocess(output, gain, pad, shape, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD):
+    """Decode one YOLOv8-style head output of shape (4 + classes, anchors) with class-aware NMS."""
+    import cv2
+    preds = output.T
+    scores = preds[:, 4:]
+    cls = scores.argmax(axis=1)
+    conf = scores[np.arange(len(cls)), cls]
+    keep = conf > conf_threshold
+    preds, cls, conf = preds[keep], cls[keep], conf[keep]
+
+    if len(conf) == 0:
+        return Detections(Boxes(np.zeros((0, 4), dtype=np.float32), conf, cls))
+
+    cx, cy, bw, bh = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    xyxy = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+
+    # Offset boxes by class so one NMS pass never suppresses across classes
+    offset = cls[:, None].astype(np.float32) * 7680
+    nms_boxes = xyxy + offset
+    indices = cv2.dnn.NMSBoxes(
+        [[b[0], b[1], b[2] - b[0], b[3] - b[1]] for b in nms_boxes.tolist()],
+        conf.tolist(), conf_threshold, iou_threshold,
+    )
+    indices = np.array(indices, dtype=int).reshape(-1)
+    xyxy, conf, cls = xyxy[indices], conf[indices], cls[indices]
+
+    xyxy[:, [0, 2]] -= pad[0]
+    xyxy[:, [1, 3]] -= pad[1]
+    xyxy /= gain
+    h, w = shape
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+    return Detections(Boxes(xyxy.astype(np.float32), conf.astype(np.float32), cls))
+
+class ExportedDetector(ABC):
+    """
+    Runs an exported YOLO detector outside PyTorch. Subclasses provide
+    `_infer(batch)` for a specific runtime; pre- and post-processing are shared
+    and mirror what `ultralytics` does, so results match the PyTorch path.
+    """
+
+    def __init__(self, path, threads=DETECTOR_THREADS):
+        self.path = path
+        self.threads = threads
+
+    def __call__(self, source, imgsz=DEFAULT_IMGSZ, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        imgsz = int(np.ceil(imgsz / STRIDE) * STRIDE)
+
+        prepared = [letterbox(img, imgsz) for img in images]
+        batch = np.stack([padded[:, :, ::-1].transpose(2, 0, 1) for padded, _, _ in prepared])
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+        outputs = self._infer(batch)
+        return [
+            postprocess(output, gain, pad, img.shape[:2], conf, iou)
+            for output, (_, gain, pad), img in zip(outputs, prepared, images)
+        ]
+
+    @abstractmethod
+    def _infer(self, batch):
+        """Raw network output for a preprocessed NCHW float32 batch."""
+
+class OnnxRuntimeDetector(ExportedDetector):
+    def __init__(self, path, threads=DETECTOR_THREADS):
+        super().__init__(path, threads)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenVinoDetector(ExportedDetector):
+    def __init__(self, path, threads=DETECTOR_THREADS):
+        super().__init__(path, threads)
+        import openvino as ov
+
+        xml = path if path.endswith(".xml") else glob.glob(os.path.join(path, "*.xml"))[0]
+        core = ov.Core()
+        model = core.read_model(xml)
+        # Let each call pick its own batch and input size (two-stage detection uses two sizes)
+        model.reshape({model.inputs[0].any_name: ov.PartialShape([-1, 3, -1, -1])})
+        self.compiled = core.compile_model(model, "CPU", {
+            "INFERENCE_NUM_THREADS": threads,
+            "PERFORMANCE_HINT": "LATENCY",
+        })
+
+    def _infer(self, batch):
+        return self.compiled(batch)[self.compiled.output(0)]
+
+def backend_for(path):
+    """Pick the runtime from the weights path: .onnx, an OpenVINO dir/.xml, or PyTorch otherwise."""
+    if path.endswith(".onnx"):
+        return "onnx"
+    if path.endswith(".xml") or path.endswith("_openvino_model") or os.path.isdir(path):
+        return "openvino"
+    return "torch"
+
+def load_detector(path, threads=DETECTOR_THREADS):
+    backend = backend_for(path)
+    if backend == "onnx":
+        return OnnxRuntimeDetector(path, threads)
+    if backend == "openvino":
+        return OpenVinoDetector(path, threads)
+    from ultralytics import YOLO
+    return YOLO(path)
+
+class CalibrationImages:
+    """ONNX Runtime calibration reader feeding letterboxed sample screenshots."""
+
+    def __init__(self, input_name, image_paths, imgsz):
+        self.input_name = input_name
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        import cv2
+        while self.image_paths:
+            img = cv2.imread(self.image_paths.pop())
+            if img is None:
+                continue
+            padded, _, _ = letterbox(img, self.imgsz)
+            batch = padded[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+            return {self.input_name: np.ascontiguousarray(batch)}
+        return None
+
+def export_detector(weights="weights/best.pt", backend="onnx", imgsz=DEFAULT_IMGSZ, int8=False,
+                    calibration_dir=None, data=None):
+    """
+    Export PyTorch weights for CPU inference. ONNX exports are dynamic in batch
+    and size; with `int8` they are statically quantized using screenshots from
+    `calibration_dir` (dynamic weight-only quantization without it). OpenVINO
+    INT8 uses Ultralytics' NNCF path and needs a dataset YAML in `data`.
+    Returns the exported path.
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    if backend == "openvino":
+        return model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8, data=data)
+
+    path = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    if not int8:
+        return path
+
+    from onnxruntime.quantization import QuantType, QuantFormat, quantize_dynamic, quantize_static
+    quantized = path.replace(".onnx", "_int8.onnx")
+    images = sorted(glob.glob(os.path.join(calibration_dir, "*"))) if calibration_dir else []
+    if images:
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(path, quantized, CalibrationImages(input_name, images, imgsz),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, per_channel=True)
+    else:
+        print("No calibration images given, falling back to dynamic (weight-only) INT8 quantization")
+        quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+    return quantized
+
+def check_parity(image_paths, exported_path, weights="weights/best.pt"):
+    """
+    Compare an exported detector against the PyTorch model on real screenshots,
+    both run through the same detection pipeline as uploads (DETECTION_MODE,
+    BOARD_IMGSZ, PIECE_IMGSZ): the fraction of boards whose piece placement
+    matches exactly, the fraction of squares that match, and the mean
+    per-image latency of each backend. Returns the report.
+    """
+    import cv2
+    from modules.image_to_fen import DETECTION_MODE, BOARD_IMGSZ, PIECE_IMGSZ, get_fens_from_images
+    from modules.model_registry import LoadedModel
+
+    models = {
+        "torch": LoadedModel("parity_torch", weights, load_detector(weights)),
+        "exported": LoadedModel("parity_exported", exported_path, load_detector(exported_path)),
+    }
+    for model in models.values():
+        model.warm_up()
+    boards = squares = total_squares = 0
+    timings = {name: 0.0 for name in models}
+
+    images = [img for img in (cv2.imread(p) for p in image_paths) if img is not None]
+    for img in images:
+        placements = {}
+        for name, model in models.items():
+            start = time.perf_counter()
+            placements[name] = get_fens_from_images([img], 'w', model=model)[0].split()[0]
+            timings[name] += time.perf_counter() - start
+        expected, actual = placements["torch"], placements["exported"]
+
+        boards += expected == actual
+        for exp_row, act_row in zip(_expand(expected), _expand(actual)):
+            squares += sum(a == b for a, b in zip(exp_row, act_row))
+            total_squares += 8
+
+    count = max(1, len(images))
+    return {
+        "images": len(images),
+        "detection_mode": DETECTION_MODE,
+        "board_imgsz": BOARD_IMGSZ,
+        "piece_imgsz": PIECE_IMGSZ,
+        "board_agreement": boards / count,
+        "square_agreement": squares / max(1, total_squares),
+        "torch_ms": timings["torch"] * 1000 / count,
+        "exported_ms": timings["exported"] * 1000 / count,
+    }
+
+def _expand(placement):
+    return [''.join('.' * int(c) if c.isdigit() else c for c in row) for row in placement.split('/')]
+
+if __name__ == '__main__':
+    # python -m modules.detector_backends export onnx [--int8] [calibration_dir]
+    # python -m modules.detector_backends parity <exported_path> <image_dir>
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "export":
+        backend = sys.argv[2] if len(sys.argv) > 2 else "onnx"
+        int8 = "--int8" in sys.argv
+        extra = [a for a in sys.argv[3:] if a != "--int8"]
+        print(export_detector(backend=backend, int8=int8, calibration_dir=extra[0] if extra else None))
+    elif command == "parity":
+        print(check_parity(sorted(glob.glob(os.path.join(sys.argv[3], "*"))), sys.argv[2]))
+    else:
+        print("usage: python -m modules.detector_backends export [onnx|openvino] [--int8] [calibration_dir]")
+        print("       python -m modules.detector_backends parity <exported_path> <image_dir>")
@@ -0,0 +1,207 @@
+# modules/engine_pool.py
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+import chess
+import chess.engine
+
+ENGINE_PATH = os.getenv("STOCKFISH_PATH", "stockfish/stockfish-ubuntu-x86-64-avx2")
+ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", "2"))
+ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", "1"))
+ENGINE_HASH_MB = int(os.getenv("ENGINE_HASH_MB", "128"))
+# Also stop fixed-depth searches after this many nodes; with one thread per
+# engine the results no longer depend on machine speed or load. 0 disables.
+ENGINE_NODES = int(os.getenv("ENGINE_NODES", "0"))
+
+class EnginePool:
+    """
+    Fixed-size pool of long-lived UCI engine processes.
+
+    Engines are spawned lazily up to `size`, checked out for the duration of a
+    search and checked back in afterwards, so requests never pay for process
+    startup or a cold hash table. Engines that die mid-search are discarded and
+    replaced on the next checkout.
+    """
+
+    def __init__(self, engine_path=ENGINE_PATH, size=ENGINE_POOL_SIZE,
+                 threads=ENGINE_THREADS, hash_mb=ENGINE_HASH_MB):
+        self.engine_path = engine_path
+        self.size = max(1, size)
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._restarts = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _spawn(self):
+        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+        try:
+            engine.configure({k: v for k, v in self.options.items() if k in engine.options})
+        except Exception:
+            engine.quit()
+            raise
+        return engine
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Engine pool is closed")
+                if self._idle:
+                    # LIFO keeps the most recently used (hottest) engine busy
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    self._in_use += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Timed out waiting for a free engine")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            return self._spawn()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, engine, broken=False):
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._created -= 1
+                if broken:
+                    self._restarts += 1
+            else:
+                self._idle.append(engine)
+            self._cond.notify()
+
+        if broken or self._closed:
+            _quit_quietly(engine)
+
+    @contextmanager
+    def engine(self, timeout=None):
+        """Check out an engine for exclusive use inside a `with` block."""
+        engine = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield engine
+        except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+            broken = True
+            raise
+        finally:
+            self.release(engine, broken=broken)
+
+    def analyse(self, board, limit, retries=1, **kwargs):
+        """Run `engine.analyse` on a pooled engine, restarting it if it crashed."""
+        if ENGINE_NODES:
+            # A new game clears the hash, so node-limited results do not depend on earlier searches
+            kwargs.setdefault("game", object())
+        for attempt in range(retries + 1):
+            try:
+                with self.engine() as engine:
+                    return engine.analyse(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                print(f"Engine terminated during search (attempt {attempt + 1}), restarting")
+                if attempt == retries:
+                    raise
+
+    def warm_up(self):
+        """Spawn every engine up front so the first requests do not pay for startup."""
+        while True:
+            with self._cond:
+                if self._closed or self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                engine = self._spawn()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(engine)
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "restarts": self._restarts,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for engine in idle:
+            _quit_quietly(engine)
+
+def _quit_quietly(engine):
+    try:
+        engine.quit()
+    except Exception:
+        try:
+            engine.close()
+        except Exception:
+            pass
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_engine_pool(engine_path=ENGINE_PATH):
+    """Return the process-wide pool for `engine_path`, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(engine_path)
+        if pool is None:
+            pool = EnginePool(engine_path)
+            _pools[engine_path] = pool
+        return pool
+
+def search_limit(depth):
+    """Limit for a fixed-depth search, capped at ENGINE_NODES when that is set."""
+    return chess.engine.Limit(depth=depth, nodes=ENGINE_NODES or None)
+
+def engine_pool_stats():
+    """`stats()` of every pool in this process, by engine path."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {path: pool.stats() for path, pool in pools.items()}
+
+def shutdown_engine_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def _shutdown_after_main_thread():
+    threading.main_thread().join()
+    shutdown_engine_pools()
+
+# SimpleEngine keeps a non-daemon event loop thread per engine, and the
+# interpreter joins those before it runs atexit hooks, so an atexit hook would
+# never fire. Gunicorn workers close the pools from worker_exit; elsewhere a
+# daemon thread closes them as soon as the main thread finishes, before that join.
+threading.Thread(target=_shutdown_after_main_thread, name="engine-pool-exit", daemon=True).start()
@@ -1,22 +1,20 @@
 import chess
 import chess.engine
-
-ENGINE_PATH = "stockfish/stockfish-ubuntu-x86-64-avx2"
+from modules.engine_pool import ENGINE_PATH, get_engine_pool, search_limit
+from modules.analysis_cache import analysis_cache
 
 def get_engine_eval_score(fen, move_uci, depth=15):
     board = chess.Board(fen)
     board.push(chess.Move.from_uci(move_uci))
 
-    with chess.engine.SimpleEngine.popen_uci(ENGINE_PATH) as engine:
-        info = engine.analyse(board, chess.engine.Limit(depth=depth))
-        eval_score = info["score"].white().score(mate_score=10000)
+    info = get_engine_pool(ENGINE_PATH).analyse(board, search_limit(depth))
+    eval_score = info["score"].white().score(mate_score=10000)
     return eval_score
 
 def get_pv_line_info(fen, depth=15):
     board = chess.Board(fen)
 
-    with chess.engine.SimpleEngine.popen_uci(ENGINE_PATH) as engine:
-        infos = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=3)
+    infos = get_engine_pool(ENGINE_PATH).analyse(board, search_limit(depth), multipv=3)
 
     move_infos = []
     for info in infos:
@@ -29,42 +27,133 @@ def get_pv_line_info(fen, depth=15):
         })
     return move_infos
 
-def evaluate_king_safety(fen, move_uci):
-    board = chess.Board(fen)
-    board.push(chess.Move.from_uci(move_uci))
-    king_square = board.king(board.turn)
-    return 0 if board.is_attacked_by(not board.turn, king_square) else 1
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+TACTICAL_PLIES = 5  # Only the first few moves of a line matter
+ADVANCED_CACHE_KIND = "advanced:v3"
 
-def evaluate_positional_score(fen, move_uci):
-    board = chess.Board(fen)
-    board.push(chess.Move.from_uci(move_uci))
+def attacked_mask(board, color):
+    """Bitboard of every square attacked by `color`."""
+    mask = 0
+    for square in chess.scan_forward(board.occupied_co[color]):
+        mask |= board.attacks_mask(square)
+    return mask
 
-    center_squares = [chess.D4, chess.D5, chess.E4, chess.E5]
-    center_control = sum(1 for sq in center_squares if board.is_attacked_by(board.turn, sq))
+def king_zone(board, color):
+    """Bitboard of the king's square and its neighbours."""
+    king = board.king(color)
+    return 0 if king is None else chess.BB_KING_ATTACKS[king] | chess.BB_SQUARES[king]
 
-    development_score = sum(
-        1 for sq, piece in board.piece_map().items()
-        if piece.color == board.turn and piece.piece_type in [chess.KNIGHT, chess.BISHOP, chess.QUEEN]
+def material_balance(board):
+    """Material from White's point of view, in pawns."""
+    return sum(
+        value * (chess.popcount(board.pieces_mask(piece_type, chess.WHITE)) -
+                 chess.popcount(board.pieces_mask(piece_type, chess.BLACK)))
+        for piece_type, value in PIECE_VALUES.items()
     )
 
-    return center_control + development_score
-
-def evaluate_tactical_complexity(pv_line):
+def tactical_complexity(board, pv_line, plies=TACTICAL_PLIES):
+    """Captures and checks in the first `plies` of a line, replayed on `board` and undone afterwards."""
     complexity = 0
-    for move_uci in pv_line[:5]:  # Only first few moves matter
-        move = chess.Move.from_uci(move_uci)
-        if "x" in move_uci:
-            complexity += 1
+    pushed = 0
+    try:
+        for move in pv_line[:plies]:
+            move = chess.Move.from_uci(move) if isinstance(move, str) else move
+            if not board.is_legal(move):
+                break
+            complexity += board.is_capture(move) + board.gives_check(move)
+            board.push(move)
+            pushed += 1
+    finally:
+        for _ in range(pushed):
+            board.pop()
     return complexity
 
-def analyze_move_from_fen(fen, move_uci, pv_line):
+def move_features(board, move):
+    """
+    Heuristic features of `move` for the side to move. The move is pushed on
+    `board` and popped again, so one board serves every move of a position.
+    """
+    color = board.turn
+    sign = 1 if color == chess.WHITE else -1
+    if board.is_en_passant(move):
+        captured_value = PIECE_VALUES[chess.PAWN]
+    else:
+        captured = board.piece_type_at(move.to_square)
+        captured_value = PIECE_VALUES[captured] if captured else 0
+    features = {
+        "move": move.uci(),
+        "color": "white" if color == chess.WHITE else "black",
+        "is_capture": board.is_capture(move),
+        "gives_check": board.gives_check(move),
+        "captured_value": captured_value,
+    }
+
+    board.push(move)
+    try:
+        own_attacks = attacked_mask(board, color)
+        enemy_attacks = attacked_mask(board, not color)
+        home_rank = chess.BB_RANK_1 if color == chess.WHITE else chess.BB_RANK_8
+        minors = board.pieces_mask(chess.KNIGHT, color) | board.pieces_mask(chess.BISHOP, color)
+        # The moved piece is en prise if the opponent attacks it and nothing defends it
+        hanging = bool(enemy_attacks & chess.BB_SQUARES[move.to_square]) and \
+            not board.attackers_mask(color, move.to_square)
+        hanging_value = PIECE_VALUES[board.piece_type_at(move.to_square)] if hanging else 0
+
+        features.update({
+            "center_control": chess.popcount(own_attacks & chess.BB_CENTER),
+            "development": chess.popcount(minors & ~home_rank),
+            "king_zone_attacks": chess.popcount(enemy_attacks & king_zone(board, color)),
+            "enemy_king_zone_attacks": chess.popcount(own_attacks & king_zone(board, not color)),
+            "hanging_value": hanging_value,
+            # Cheap stand-in for an engine eval (centipawns, White's view) for moves the engine did not search
+            "static_eval": (material_balance(board) - sign * hanging_value) * 100,
+        })
+    finally:
+        board.pop()
+
+    # Graded rather than the old 0/1 flag: fewer enemy attacks on the squares around the king is safer
+    features["king_safety"] = -features["king_zone_attacks"]
+    features["positional_score"] = features["center_control"] + features["development"]
+    return features
+
+def extract_move_features(board, moves=None, pv_lines=None):
+    """
+    Features for every move in `moves` (all legal moves by default) in one
+    pass over a single board. `pv_lines` maps moves to their principal
+    variations for PV length and tactical complexity.
+    """
+    pv_lines = pv_lines or {}
+    features = []
+    for move in list(board.legal_moves if moves is None else moves):
+        line = pv_lines.get(move, [move])
+        metrics = move_features(board, move)
+        metrics["pv_length"] = len(line)
+        metrics["tactical_complexity"] = tactical_complexity(board, line)
+        features.append(metrics)
+    return features
+
+def analyze_move_from_fen(fen, move_uci, pv_line, engine_eval=None):
+    if engine_eval is None:
+        engine_eval = get_engine_eval_score(fen, move_uci)
+    move = chess.Move.from_uci(move_uci)
+    metrics = extract_move_features(chess.Board(fen), [move], {move: pv_line})[0]
+    metrics["engine_eval"] = engine_eval
+    return metrics
+
+def suggestion_to_pv_info(fen, move, pv_line, score):
+    """
+    Convert a `(move, pv_line, score)` suggestion from `get_top_moves_with_analysis`
+    into the pv info used for ranking, taking the engine eval straight from the
+    MultiPV score instead of searching the position again.
+    """
+    board = chess.Board(fen)
+    # Suggestion scores are relative to the side to move; engine_eval is from White's view
+    white_score = score if board.turn == chess.WHITE else -score
     return {
-        "move": move_uci,
-        "engine_eval": get_engine_eval_score(fen, move_uci),
+        "move_uci": move.uci(),
+        "pv_line": [m.uci() for m in pv_line],
         "pv_length": len(pv_line),
-        "tactical_complexity": evaluate_tactical_complexity(pv_line),
-        "king_safety": evaluate_king_safety(fen, move_uci),
-        "positional_score": evaluate_positional_score(fen, move_uci)
+        "engine_eval": white_score.score(mate_score=10000),
     }
 
 WEIGHTS = {
@@ -81,16 +170,16 @@ def normalize(value, min_val, max_val):
     return (value - min_val) / (max_val - min_val)
 
 def rank_moves(move_metrics_list):
-    # Extract metric values
-    engine_scores = [m["engine_eval"] for m in move_metrics_list]
+    # Extract metric values; engine evals are from White's view, rank them from the mover's
+    engine_scores = [m["engine_eval"] * (-1 if m.get("color") == "black" else 1) for m in move_metrics_list]
     pv_lengths = [m["pv_length"] for m in move_metrics_list]
     tactical = [m["tactical_complexity"] for m in move_metrics_list]
     safety = [m["king_safety"] for m in move_metrics_list]
     positional = [m["positional_score"] for m in move_metrics_list]
 
     # Normalize all
-    for m in move_metrics_list:
-        m["norm_engine_eval"] = normalize(m["engine_eval"], min(engine_scores), max(engine_scores))
+    for m, engine_score in zip(move_metrics_list, engine_scores):
+        m["norm_engine_eval"] = normalize(engine_score, min(engine_scores), max(engine_scores))
         m["norm_pv_length"] = normalize(m["pv_length"], min(pv_lengths), max(pv_lengths))
         m["norm_tactical_complexity"] = normalize(m["tactical_complexity"], min(tactical), max(tactical))
         m["norm_king_safety"] = normalize(m["king_safety"], min(safety), max(safety))
@@ -128,26 +217,88 @@ making it a well-rounded and strategic option in this position.
 
     return explanation
 
-def perform_advanced_analysis(fen, top_n=3):
+def rank_static_below_engine(move_metrics, color):
+    """
+    Give moves outside the MultiPV an `engine_eval` strictly below the worst
+    searched move (from the mover's view), keeping their static-eval order.
+    Material counts and engine scores are not on the same scale, so a raw
+    static eval could otherwise outrank the engine's own best move.
+    """
+    sign = 1 if color == chess.WHITE else -1
+    searched = [sign * m["engine_eval"] for m in move_metrics if m["eval_source"] == "engine"]
+    unsearched = [m for m in move_metrics if m["eval_source"] == "static"]
+    if not unsearched:
+        return
+    floor = min(searched) - 1 if searched else 0
+    top = max(sign * m["static_eval"] for m in unsearched)
+    for m in unsearched:
+        m["engine_eval"] = sign * (floor - (top - sign * m["static_eval"]))
+
+def perform_advanced_analysis(fen, top_n=3, suggestions=None, depth=None, use_cache=True, rank_all=False):
     """
     Given a FEN string and number of top moves to analyze, returns:
         1. Best move data (dict)
         2. List of all top_n move data dicts
         3. Natural language explanation of the best move
+
+    If `suggestions` from `get_top_moves_with_analysis` are passed, every engine
+    number is taken from that MultiPV search and no further searches are run;
+    `depth` should then be the depth those suggestions were searched at.
+
+    With `rank_all`, every legal move is ranked, not just the engine's top_n;
+    moves outside the MultiPV get a static material-and-safety eval instead.
     """
+    if depth is None:
+        depth = 15 if suggestions is None else 20
+    cache_kind = f"{ADVANCED_CACHE_KIND}:all" if rank_all else ADVANCED_CACHE_KIND
+
+    if use_cache:
+        cached = analysis_cache.get(fen, cache_kind, depth, top_n, exact_multipv=True)
+        if cached is not None:
+            return tuple(cached)
+
     # Step 1: Get top N moves with PV lines
-    pv_infos = get_pv_line_info(fen, depth=15)[:top_n]
+    if suggestions is not None:
+        pv_infos = [
+            suggestion_to_pv_info(fen, move, pv_line, score)
+            for move, pv_line, score in suggestions[:top_n]
+        ]
+    else:
+        pv_infos = get_pv_line_info(fen, depth=depth)[:top_n]
+
+    if not pv_infos:
+        return None, [], ""
 
-    # Step 2: Analyze each move in detail
-    move_metrics = [
-        analyze_move_from_fen(fen, info["move_uci"], info["pv_line"])
+    # Step 2: Features for every candidate, all on one board
+    board = chess.Board(fen)
+    pv_lines = {
+        chess.Move.from_uci(info["move_uci"]): [chess.Move.from_uci(uci) for uci in info["pv_line"]]
         for info in pv_infos
-    ]
+    }
+    engine_evals = {info["move_uci"]: info.get("engine_eval") for info in pv_infos}
+    moves = list(board.legal_moves) if rank_all else list(pv_lines)
+    move_metrics = extract_move_features(board, moves, pv_lines)
+
+    for metrics in move_metrics:
+        if metrics["move"] in engine_evals:
+            engine_eval = engine_evals[metrics["move"]]
+            metrics["engine_eval"] = engine_eval if engine_eval is not None else get_engine_eval_score(fen, metrics["move"])
+            metrics["eval_source"] = "engine"
+        else:
+            metrics["eval_source"] = "static"
+
+    rank_static_below_engine(move_metrics, board.turn)
 
     # Step 3: Rank the moves
     best_move, all_moves = rank_moves(move_metrics)
+    if rank_all:
+        # Searched moves always come first; the heuristics only order moves within each group
+        all_moves = sorted(all_moves, key=lambda m: (m["eval_source"] == "engine", m["total_score"]), reverse=True)
+        best_move = all_moves[0]
 
     # Step 4: Generate explanation for best move
     reasoning = generate_reasoning(best_move)
 
+    if use_cache:
+        analysis_cache.put(fen, cache_kind, depth, top_n, [best_move, all_moves, reasoning])
     return best_move, all_moves, reasoning
@@ -0,0 +1,173 @@
+# modules/fast_path.py
+
+import os
+import threading
+import chess
+import chess.engine
+import chess.polyglot
+import chess.syzygy
+
+OPENING_BOOK_PATH = os.getenv("OPENING_BOOK", "books/book.bin")
+# One or more Syzygy directories, separated like PATH
+SYZYGY_PATH = os.getenv("SYZYGY_PATH", "syzygy")
+BOOK_PV_PLIES = int(os.getenv("BOOK_PV_PLIES", "8"))
+TABLEBASE_PV_PLIES = int(os.getenv("TABLEBASE_PV_PLIES", "10"))
+# Tablebase wins are reported as centipawns just below any mate score (mate_score=10000 elsewhere)
+TABLEBASE_WIN_CP = 9000
+
+class FastPath:
+    """
+    Answers positions without an engine search where a local resource already
+    knows the answer: Polyglot opening books for known openings and Syzygy
+    tablebases for endgames with few pieces. Results use the same
+    `(move, pv_line, score)` shape as the engine, scores relative to the side
+    to move. Missing books or tablebases simply disable that path.
+    """
+
+    def __init__(self, book_path=OPENING_BOOK_PATH, syzygy_path=SYZYGY_PATH):
+        self.book_path = book_path
+        self.syzygy_path = syzygy_path
+        self._book = None
+        self._tablebase = None
+        self._opened = False
+        self._lock = threading.Lock()
+        self.counters = {"book": 0, "tablebase": 0, "engine": 0}
+
+    def _open(self):
+        if self._opened:
+            return
+        if self.book_path and os.path.isfile(self.book_path):
+            self._book = chess.polyglot.open_reader(self.book_path)
+            print(f"Opening book loaded from {self.book_path}")
+
+        directories = [d for d in (self.syzygy_path or "").split(os.pathsep) if os.path.isdir(d)]
+        if directories:
+            self._tablebase = chess.syzygy.Tablebase()
+            for directory in directories:
+                self._tablebase.add_directory(directory)
+            print(f"Syzygy tablebases loaded from {', '.join(directories)}")
+        self._opened = True
+
+    def probe(self, board, top_n=3):
+        """Book or tablebase suggestions for `board`, or None if neither knows the position."""
+        with self._lock:
+            self._open()
+            suggestions = self._probe_tablebase(board, top_n)
+            if suggestions:
+                self.counters["tablebase"] += 1
+                return suggestions
+            suggestions = self._probe_book(board, top_n)
+            if suggestions:
+                self.counters["book"] += 1
+                return suggestions
+            self.counters["engine"] += 1
+            return None
+
+    def _book_moves(self, board):
+        """Distinct book moves, most heavily weighted first."""
+        weights = {}
+        for entry in self._book.find_all(board):
+            weights[entry.move] = weights.get(entry.move, 0) + entry.weight
+        return sorted(weights, key=weights.get, reverse=True)
+
+    def _probe_book(self, board, top_n):
+        if self._book is None:
+            return None
+        moves = self._book_moves(board)[:top_n]
+        if not moves:
+            return None
+
+        suggestions = []
+        for move in moves:
+            # Continue each line along the main book moves for as long as the book knows it
+            line = board.copy(stack=False)
+            line.push(move)
+            pv = [move]
+            while len(pv) < BOOK_PV_PLIES:
+                continuation = self._book_moves(line)
+                if not continuation:
+                    break
+                line.push(continuation[0])
+                pv.append(continuation[0])
+            # Book positions are theory; treat them as balanced
+            suggestions.append((move, pv, chess.engine.Cp(0)))
+        return suggestions
+
+    def _rank_tablebase_moves(self, board):
+        """
+        Legal moves with their exact result for the side to move: (move, wdl, dtz),
+        best first. Returns None if any resulting position is missing from the tablebases.
+        """
+        ranked = []
+        for move in board.legal_moves:
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    ranked.append((move, 2, 0))
+                    continue
+                wdl = self._tablebase.get_wdl(board)
+                dtz = self._tablebase.get_dtz(board)
+            finally:
+                board.pop()
+            if wdl is None or dtz is None:
+                return None
+            # Probed from the opponent's side after the move; flip to the mover's
+            ranked.append((move, -wdl, -dtz))
+
+        # Win fastest, lose slowest; among equal results prefer zeroing moves (captures, pawn moves)
+        ranked.sort(key=lambda item: (
+            -item[1],
+            abs(item[2]) if item[1] > 0 else -abs(item[2]),
+            not board.is_zeroing(item[0]),
+        ))
+        return ranked
+
+    def _probe_tablebase(self, board, top_n):
+        if self._tablebase is None or board.castling_rights or board.is_game_over():
+            return None
+        if chess.popcount(board.occupied) > chess.syzygy.TBPIECES:
+            return None
+        ranked = self._rank_tablebase_moves(board)
+        if not ranked:
+            return None
+
+        suggestions = []
+        for move, wdl, dtz in ranked[:top_n]:
+            line = board.copy(stack=False)
+            line.push(move)
+            pv = [move]
+            while len(pv) < TABLEBASE_PV_PLIES and not line.is_game_over():
+                reply = self._rank_tablebase_moves(line)
+                if not reply:
+                    break
+                line.push(reply[0][0])
+                pv.append(reply[0][0])
+            suggestions.append((move, pv, tablebase_score(wdl, dtz)))
+        return suggestions
+
+    def stats(self):
+        with self._lock:
+            answered = self.counters["book"] + self.counters["tablebase"]
+            total = answered + self.counters["engine"]
+            return {
+                **self.counters,
+                "book_loaded": self._book is not None,
+                "tablebase_loaded": self._tablebase is not None,
+                "hit_rate": answered / total if total else 0.0,
+            }
+
+def tablebase_score(wdl, dtz):
+    """Engine-style score for a tablebase result from the mover's point of view."""
+    if wdl == 2 and dtz == 0:
+        return chess.engine.Mate(1)
+    if wdl == 2:
+        return chess.engine.Cp(TABLEBASE_WIN_CP - abs(dtz))
+    if wdl == -2:
+        return chess.engine.Cp(-(TABLEBASE_WIN_CP - abs(dtz)))
+    # Cursed wins and blessed losses are draws under the fifty-move rule
+    return chess.engine.Cp(0)
+
+fast_path = FastPath()
+
+def probe_fast_path(board, top_n=3):
+    return fast_path.probe(board, top_n)
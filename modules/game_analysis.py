@@ -0,0 +1,265 @@
+# modules/game_analysis.py
+
+import io
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import chess
+import chess.engine
+import chess.pgn
+from modules.engine_pool import ENGINE_PATH, ENGINE_POOL_SIZE, get_engine_pool
+from modules.chess_engine import get_top_moves_with_analysis
+from modules.eval_strategy import perform_advanced_analysis
+from modules.metrics import span, register_queue
+
+# Shallower than a standalone analysis: every ply starts from the previous ply's hash
+GAME_DEPTH = int(os.getenv("GAME_DEPTH", "16"))
+# Requested depths are clamped here; each ply costs roughly twice as much per extra ply of depth
+GAME_MAX_DEPTH = int(os.getenv("GAME_MAX_DEPTH", "22"))
+# Two lines are enough for the best move and the best alternative to the move played
+GAME_MULTIPV = int(os.getenv("GAME_MULTIPV", "2"))
+GAME_MAX_PLIES = int(os.getenv("GAME_MAX_PLIES", "300"))
+# Centipawns the mover gave away (capped evals, see EVAL_CAP) for each flag
+INACCURACY_CP = int(os.getenv("GAME_INACCURACY_CP", "50"))
+MISTAKE_CP = int(os.getenv("GAME_MISTAKE_CP", "100"))
+BLUNDER_CP = int(os.getenv("GAME_BLUNDER_CP", "200"))
+# Evals are capped here when comparing, so a slower mate in a won position is not a blunder
+EVAL_CAP = 1000
+MATE_SCORE = 10000
+
+_executor = ThreadPoolExecutor(max_workers=ENGINE_POOL_SIZE, thread_name_prefix="game")
+register_queue("game", _executor)
+
+def game_from_pgn(pgn_text):
+    """`(boards, moves, headers)` for the mainline of the first game in `pgn_text`."""
+    game = chess.pgn.read_game(io.StringIO(pgn_text))
+    if game is None:
+        raise ValueError("No game found in PGN")
+    if game.errors:
+        raise ValueError(f"Invalid PGN: {game.errors[0]}")
+
+    board = game.board()
+    boards, moves = [board.copy(stack=False)], []
+    for move in game.mainline_moves():
+        board.push(move)
+        moves.append(move)
+        boards.append(board.copy(stack=False))
+    return boards, moves, dict(game.headers)
+
+def game_from_fens(fens):
+    """`(boards, moves, headers)` for consecutive positions; each pair must be one legal move apart."""
+    boards = [chess.Board(fen) for fen in fens]
+    moves = []
+    for idx, (board, following) in enumerate(zip(boards, boards[1:])):
+        move = next((
+            move for move in board.legal_moves
+            if _after(board, move).board_fen() == following.board_fen() and board.turn != following.turn
+        ), None)
+        if move is None:
+            raise ValueError(f"No legal move leads from position {idx} to position {idx + 1}")
+        moves.append(move)
+    return boards, moves, {}
+
+def load_game(pgn=None, fens=None):
+    """`(boards, moves, headers)` from a PGN or a list of FENs; raises ValueError on bad input."""
+    if pgn:
+        boards, moves, headers = game_from_pgn(pgn)
+    elif fens:
+        boards, moves, headers = game_from_fens(fens)
+    else:
+        raise ValueError("Provide a PGN or a list of FENs")
+    if not moves:
+        raise ValueError("The game has no moves")
+    if len(moves) > GAME_MAX_PLIES:
+        raise ValueError(f"Games are limited to {GAME_MAX_PLIES} plies")
+    return boards, moves, headers
+
+def _after(board, move):
+    after = board.copy(stack=False)
+    after.push(move)
+    return after
+
+def side_to_move_cp(board, suggestions):
+    """Eval of `board` for the side to move in centipawns (mates as +-MATE_SCORE)."""
+    if board.is_checkmate():
+        return -MATE_SCORE
+    if not suggestions:
+        return 0  # Stalemate or another draw
+    return suggestions[0][2].score(mate_score=MATE_SCORE)
+
+def _cap(cp):
+    return max(-EVAL_CAP, min(EVAL_CAP, cp))
+
+def classify(loss):
+    if loss >= BLUNDER_CP:
+        return "blunder"
+    if loss >= MISTAKE_CP:
+        return "mistake"
+    if loss >= INACCURACY_CP:
+        return "inaccuracy"
+    return "good"
+
+def analyze_position(board, depth, top_n, engine=None):
+    """Suggestions and eval of one position, plus the advanced ranking of the engine's candidates."""
+    if board.is_game_over():
+        return {"suggestions": [], "cp": side_to_move_cp(board, [])}
+
+    fen = board.fen()
+    suggestions, _ = get_top_moves_with_analysis(fen, ENGINE_PATH, depth=depth, top_n=top_n, engine=engine)
+    best_move_data, _, reasoning = perform_advanced_analysis(fen, top_n=top_n, suggestions=suggestions, depth=depth)
+    return {
+        "suggestions": suggestions,
+        "cp": side_to_move_cp(board, suggestions),
+        "recommended": best_move_data["move"] if best_move_data else None,
+        "reasoning": reasoning,
+    }
+
+def _line(board, move, pv_line, score):
+    white = 1 if board.turn == chess.WHITE else -1
+    return {
+        "move": move.uci(),
+        "san": board.san(move),
+        "eval": white * score.score(mate_score=MATE_SCORE),
+        "pv": " ".join(m.uci() for m in pv_line),
+    }
+
+def ply_result(ply, board, move, before, after):
+    """Per-move review from the analysis of the positions before and after `move`."""
+    white = 1 if board.turn == chess.WHITE else -1
+    # Both evals from the mover's point of view; `after` is from the opponent's
+    mover_before, mover_after = before["cp"], -after["cp"]
+    loss = max(0, _cap(mover_before) - _cap(mover_after))
+    suggestions = before["suggestions"]
+
+    played_rank = next((idx for idx, (m, _, _) in enumerate(suggestions) if m == move), None)
+    # Only flag moves the engine would not have played itself
+    classification = "best" if played_rank == 0 else classify(loss)
+    alternative = next(((m, pv, s) for m, pv, s in suggestions if m != move), None)
+
+    return {
+        "type": "ply",
+        "ply": ply,
+        "move_number": board.fullmove_number,
+        "color": "white" if board.turn == chess.WHITE else "black",
+        "fen": board.fen(),
+        "move": move.uci(),
+        "san": board.san(move),
+        "eval_before": white * mover_before,
+        "eval_after": white * mover_after,
+        "eval_swing": white * (mover_after - mover_before),
+        "centipawn_loss": loss,
+        "classification": classification,
+        "blunder": classification == "blunder",
+        "played_rank": played_rank,
+        "best_move": _line(board, *suggestions[0]) if suggestions else None,
+        "best_alternative": _line(board, *alternative) if alternative else None,
+        "recommended": before.get("recommended"),
+        "reasoning": before.get("reasoning"),
+    }
+
+def _chunks(count, parts):
+    """Split `range(count)` into `parts` contiguous runs of nearly equal length."""
+    size, extra = divmod(count, parts)
+    start = 0
+    for part in range(parts):
+        end = start + size + (1 if part < extra else 0)
+        yield list(range(start, end))
+        start = end
+
+def _analyze_run(boards, indices, depth, top_n, results, stop):
+    """
+    Analyze consecutive positions on one checked-out engine, so each search
+    starts from the hash table of the one before. The engine is handed back
+    whenever other requests are waiting for one, and reacquired (LIFO, so
+    usually the same engine) once they have been served. A position that
+    fails reports its error and the run goes on, on a fresh engine if the
+    old one died.
+    """
+    pool = get_engine_pool(ENGINE_PATH)
+    remaining = list(indices)
+    while remaining and not stop.is_set():
+        try:
+            engine = pool.acquire()
+        except Exception as e:
+            print(f"No engine for game analysis: {e}")
+            break
+        broken = False
+        try:
+            while remaining and not stop.is_set():
+                idx = remaining.pop(0)
+                try:
+                    with span("game_position"):
+                        analysis = analyze_position(boards[idx], depth, top_n, engine)
+                except (chess.engine.EngineTerminatedError, chess.engine.EngineError) as e:
+                    print(f"Engine failed at position {idx} of the game, replacing it: {e}")
+                    results.put((idx, {"error": f"Analysis failed: {e}"}))
+                    broken = True
+                    break
+                except Exception as e:
+                    print(f"Game analysis failed at position {idx}: {e}")
+                    analysis = {"error": f"Analysis failed: {e}"}
+                results.put((idx, analysis))
+                if pool.stats()["waiting"]:
+                    break
+        finally:
+            pool.release(engine, broken=broken)
+        # Interactive requests go first; the game continues once they have their engines
+        while pool.stats()["waiting"] and not stop.is_set():
+            time.sleep(0.05)
+    for idx in remaining:
+        results.put((idx, {"error": "Analysis failed"}))
+
+def iter_game_analysis(boards, moves, depth=GAME_DEPTH, top_n=GAME_MULTIPV):
+    """
+    Analyze every position of a game and yield one `ply` result per move as
+    soon as the positions before and after it are done, then a `summary`.
+    The game is split into contiguous runs, one per pooled engine but one,
+    so a game never takes the whole pool, and each run keeps its engine
+    (and hash table) from one ply to the next.
+    """
+    start = time.perf_counter()
+    results = queue.Queue()
+    stop = threading.Event()
+    runs = max(1, min(get_engine_pool(ENGINE_PATH).size - 1, len(boards)))
+    for indices in _chunks(len(boards), runs):
+        _executor.submit(_analyze_run, boards, indices, depth, top_n, results, stop)
+
+    analyzed = {}
+    plies = []
+    try:
+        while len(analyzed) < len(boards):
+            idx, analysis = results.get()
+            analyzed[idx] = analysis
+            # The position completes the ply leading to it and the ply leaving it
+            for ply in (idx - 1, idx):
+                if 0 <= ply < len(moves) and ply in analyzed and ply + 1 in analyzed:
+                    before, after = analyzed[ply], analyzed[ply + 1]
+                    if "error" in before or "error" in after:
+                        result = {"type": "ply", "ply": ply, "move": moves[ply].uci(),
+                                  "error": before.get("error") or after.get("error")}
+                    else:
+                        result = ply_result(ply, boards[ply], moves[ply], before, after)
+                    plies.append(result)
+                    yield result
+    finally:
+        # Stops the engines early if the client went away
+        stop.set()
+
+    yield summarize_game(plies, time.perf_counter() - start)
+
+def summarize_game(plies, seconds):
+    summary = {"type": "summary", "plies": len(plies), "seconds": round(seconds, 3),
+               "ms_per_ply": round(seconds * 1000 / len(plies), 1) if plies else None}
+    for color in ("white", "black"):
+        own = [p for p in plies if p.get("color") == color]
+        counts = {label: sum(p["classification"] == label for p in own)
+                  for label in ("inaccuracy", "mistake", "blunder")}
+        summary[color] = {
+            "moves": len(own),
+            "average_centipawn_loss": round(sum(p["centipawn_loss"] for p in own) / len(own), 1) if own else None,
+            **counts,
+        }
+    summary["errors"] = sum("error" in p for p in plies)
+    return summary
@@ -1,10 +1,52 @@
 # modules/groq_explainer.py
 
 import os
-from groq import Groq
-from dotenv import load_dotenv
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.analysis_cache import analysis_cache
+from modules.metrics import span, submit_traced, register_queue
 
-load_dotenv()  # Load .env file if exists
+def load_env_file():
+    """Load a .env file if python-dotenv is installed; otherwise only the environment is used."""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+load_env_file()  # Before the settings below read the environment
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")  # or "llama3-8b-8192" for faster replies
+# Point at a local stub server (e.g. http://127.0.0.1:8080) for tests and benchmarks
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")
+# "concurrent": one request per move, in parallel; "batched": one JSON request for all moves
+EXPLANATION_MODE = os.getenv("EXPLANATION_MODE", "concurrent")
+EXPLANATION_WORKERS = int(os.getenv("EXPLANATION_WORKERS", "4"))
+EXPLANATION_SECTIONS = ("best_move_explanation", "strategic_idea", "tactical_motif")
+
+_client = None
+_client_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=EXPLANATION_WORKERS, thread_name_prefix="explain")
+register_queue("explain", _executor)
+
+def get_client():
+    """Shared Groq client; its HTTP connection pool is reused across requests."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("GROQ_API_KEY")
+                if not api_key:
+                    raise ValueError("Missing GROQ_API_KEY in environment variables")
+                kwargs = {"api_key": api_key}
+                if GROQ_BASE_URL:
+                    kwargs["base_url"] = GROQ_BASE_URL
+                from groq import Groq
+                _client = Groq(**kwargs)
+    return _client
 
 def build_prompt(fen, best_move, pv_line, score):
     move_sequence = " → ".join([move.uci() for move in pv_line])
@@ -28,33 +70,250 @@ Please explain the following in simple, clear, beginner-friendly language (one s
    Is there a short-term tactical reason (e.g., fork, pin, discovered attack) that makes this move strong?
 """.strip()
 
-def get_explanation_from_groq(prompt, stream=True):
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise ValueError("Missing GROQ_API_KEY in environment variables")
-
-    client = Groq(api_key=api_key)
-
-    completion = client.chat.completions.create(
-        model="llama3-70b-8192",  # or "llama3-8b-8192" for faster replies
+def stream_explanation_from_groq(prompt):
+    """Yield explanation text chunks as the LLM produces them."""
+    completion = get_client().chat.completions.create(
+        model=GROQ_MODEL,
         messages=[{"role": "user", "content": prompt}],
         temperature=0.6,
         max_tokens=128,
         top_p=0.95,
-        stream=stream,
+        stream=True,
     )
+    for chunk in completion:
+        content = chunk.choices[0].delta.content or ""
+        if content:
+            yield content
 
-    print("🧠 Explanation:\n")
+def get_explanation_from_groq(prompt, stream=True, on_token=None):
     explanation = ""
 
-    if stream:
-        for chunk in completion:
-            content = chunk.choices[0].delta.content or ""
-            print(content, end="", flush=True)
-            explanation += content
-    else:
-        message = completion.choices[0].message.content
-        print(message)
-        explanation = message
+    with span("llm_request"):
+        if stream:
+            for content in stream_explanation_from_groq(prompt):
+                explanation += content
+                if on_token:
+                    on_token(content)
+        else:
+            completion = get_client().chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.6,
+                max_tokens=128,
+                top_p=0.95,
+                stream=False,
+            )
+            explanation = completion.choices[0].message.content
 
+    # Printed whole so concurrent explanations do not interleave on stdout
+    print(f"🧠 Explanation:\n{explanation}")
     return explanation
+
+def build_batch_prompt(fen, suggestions):
+    lines = []
+    for idx, (move, pv_line, score) in enumerate(suggestions, 1):
+        move_sequence = " → ".join([m.uci() for m in pv_line])
+        lines.append(f"{idx}. Move {move.uci()} | Principal variation: {move_sequence} | Engine evaluation: {score}")
+    candidates = "\n".join(lines)
+    return f"""
+You are a chess coach helping a beginner understand a position.
+
+Position (FEN): {fen}
+Candidate moves:
+{candidates}
+
+For every candidate move, explain in simple, clear, beginner-friendly language (one sentence each):
+- best_move_explanation: why the move is strong, mentioning any tactical or positional advantage
+- strategic_idea: the long-term goal behind the move (e.g., piece activity, king safety, center control)
+- tactical_motif: any short-term tactical reason (e.g., fork, pin, discovered attack)
+
+Answer with JSON only, in this exact shape:
+{{"moves": [{{"move": "<uci>", "best_move_explanation": "...", "strategic_idea": "...", "tactical_motif": "..."}}]}}
+""".strip()
+
+def get_batch_explanations_from_groq(fen, suggestions):
+    """One request for all candidates with a structured JSON answer; returns {move_uci: sections}."""
+    with span("llm_request"):
+        completion = get_client().chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": build_batch_prompt(fen, suggestions)}],
+            temperature=0.6,
+            max_tokens=128 * len(suggestions),
+            top_p=0.95,
+            stream=False,
+            response_format={"type": "json_object"},
+        )
+    data = json.loads(completion.choices[0].message.content)
+
+    explanations = {}
+    for item in data.get("moves", []):
+        if isinstance(item, dict) and item.get("move"):
+            explanations[item["move"]] = {key: str(item.get(key, "")).strip() for key in EXPLANATION_SECTIONS}
+    return explanations
+
+SECTION_HEADER = re.compile(
+    r'(?:\b\d+\.\s*)?\**\s*(Best Move Explanation|Strategic Idea|Tactical Motif)\s*:?\s*\**\s*:?',
+    re.IGNORECASE,
+)
+SECTION_KEYS = {
+    "best move explanation": "best_move_explanation",
+    "strategic idea": "strategic_idea",
+    "tactical motif": "tactical_motif",
+}
+
+def split_sections(text):
+    """Map each section found in `text` to the text between its header and the next one"""
+    sections = {}
+    headers = list(SECTION_HEADER.finditer(text))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        sections[SECTION_KEYS[header.group(1).lower()]] = text[header.end():end].strip()
+    return sections
+
+def parse_explanation(explanation_text):
+    """Parse the explanation text into structured sections"""
+    parsed_explanation = {
+        "best_move_explanation": "",
+        "strategic_idea": "",
+        "tactical_motif": ""
+    }
+    
+    text = explanation_text.replace("Here are the explanations:", "").strip()
+    parsed_explanation.update(split_sections(text))
+    
+    if not any(parsed_explanation.values()):
+        parsed_explanation["best_move_explanation"] = explanation_text
+    
+    return parsed_explanation
+
+def explanation_cache_kind(move, pv_line):
+    pv = " ".join(m.uci() for m in pv_line)
+    digest = hashlib.sha256(f"{GROQ_MODEL}|{move.uci()}|{pv}".encode("utf-8")).hexdigest()[:24]
+    return f"explanation:{digest}"
+
+# A numbered / starred header cut off anywhere before its closing stars
+PARTIAL_HEADER = re.compile(r'\s*(?:\d+\.?\s*)?\**\s*([A-Za-z ]*)(?::\s*\**)?$')
+PARTIAL_HEADER_WINDOW = max(len(name) for name in SECTION_KEYS) + 12
+
+def partial_header_start(text):
+    """
+    Start of the tail of `text` that may still grow into a section header
+    once more tokens arrive, or None. Only prefixes of the three header
+    names qualify, so ordinary words are released as soon as they arrive.
+    """
+    for start in range(max(0, len(text) - PARTIAL_HEADER_WINDOW), len(text)):
+        if start and not text[start - 1].isspace():
+            continue
+        match = PARTIAL_HEADER.match(text, start)
+        if match and any(name.startswith(match.group(1).lower()) for name in SECTION_KEYS):
+            return start
+    return None
+
+class IncrementalExplanationParser:
+    """
+    Splits a streamed explanation into its three sections while tokens are
+    still arriving. `feed` returns `(section, delta)` pairs for newly completed
+    text; text that could still be the start of a header is held back until
+    the next chunk (or `finish`) disambiguates it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.emitted = {key: "" for key in EXPLANATION_SECTIONS}
+
+    def _sections(self, final):
+        text = self.text
+        if not final:
+            start = partial_header_start(text)
+            if start is not None:
+                text = text[:start]
+        return split_sections(text)
+
+    def _diff(self, final):
+        updates = []
+        for key, content in self._sections(final).items():
+            done = self.emitted[key]
+            if content.startswith(done) and len(content) > len(done):
+                updates.append((key, content[len(done):]))
+                self.emitted[key] = content
+        return updates
+
+    def feed(self, chunk):
+        self.text += chunk
+        return self._diff(final=False)
+
+    def finish(self):
+        return self._diff(final=True)
+
+def explain_move(fen, move, pv_line, score, on_delta=None):
+    prompt = build_prompt(fen, move, pv_line, score)
+    if on_delta is None:
+        # Parse the explanation into structured sections
+        return parse_explanation(get_explanation_from_groq(prompt))
+
+    parser = IncrementalExplanationParser()
+
+    def on_token(chunk):
+        for section, delta in parser.feed(chunk):
+            on_delta(section, delta)
+
+    raw_explanation = get_explanation_from_groq(prompt, on_token=on_token)
+    for section, delta in parser.finish():
+        on_delta(section, delta)
+    return parse_explanation(raw_explanation)
+
+def explain_moves(fen, suggestions, mode=None, on_result=None, on_delta=None, use_cache=True):
+    """
+    Structured explanations for every suggestion, as `[[move_uci, sections], ...]`
+    in suggestion order. Cached answers (keyed by FEN + move + PV) are returned
+    without calling the LLM; the rest are fetched concurrently on a shared
+    client, or in a single JSON request when `mode="batched"`.
+    `on_result(index, move_uci, sections)` is called as each one becomes available,
+    and in concurrent mode `on_delta(index, move_uci, section, text)` is called for
+    every piece of a section as the tokens stream in.
+    """
+    mode = mode or EXPLANATION_MODE
+    results = [None] * len(suggestions)
+    missing = []
+
+    def deliver(idx, sections, store=True):
+        move, pv_line, _ = suggestions[idx]
+        results[idx] = [move.uci(), sections]
+        if store and use_cache:
+            analysis_cache.put(fen, explanation_cache_kind(move, pv_line), 0, 1, sections)
+        if on_result:
+            on_result(idx, move.uci(), sections)
+
+    for idx, (move, pv_line, score) in enumerate(suggestions):
+        cached = analysis_cache.get(fen, explanation_cache_kind(move, pv_line), 0, 1) if use_cache else None
+        if cached is not None:
+            deliver(idx, cached, store=False)
+        else:
+            missing.append(idx)
+
+    if missing and mode == "batched":
+        try:
+            batch = get_batch_explanations_from_groq(fen, [suggestions[idx] for idx in missing])
+        except Exception as e:
+            print(f"Batched explanation failed, falling back to per-move requests: {e}")
+            batch = {}
+        for idx in list(missing):
+            sections = batch.get(suggestions[idx][0].uci())
+            if sections and any(sections.values()):
+                deliver(idx, sections)
+                missing.remove(idx)
+
+    def delta_callback(idx):
+        if on_delta is None:
+            return None
+        move_uci = suggestions[idx][0].uci()
+        return lambda section, text: on_delta(idx, move_uci, section, text)
+
+    futures = {
+        submit_traced(_executor, explain_move, fen, *suggestions[idx], on_delta=delta_callback(idx)): idx
+        for idx in missing
+    }
+    for future in as_completed(futures):
+        deliver(futures[future], future.result())
+
+    return results
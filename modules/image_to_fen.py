@@ -1,38 +1,227 @@
-import cv2
+import os
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
-from ultralytics import YOLO
+import chess
+from modules.model_registry import get_model
+
+CLASS_NAMES = ['B', 'K', 'N', 'P', 'Q', 'R', 'b', 'board', 'k', 'n', 'p', 'q', 'r']
+BOARD_CLASS = CLASS_NAMES.index('board')
+DETECTION_BATCH_SIZE = 8
+# "two_stage": find and crop the board first, then detect pieces on the crop; "single": one full-image pass
+DETECTION_MODE = os.getenv("DETECTION_MODE", "two_stage")
+BOARD_IMGSZ = int(os.getenv("BOARD_IMGSZ", "320"))
+PIECE_IMGSZ = int(os.getenv("PIECE_IMGSZ", "416"))
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "1024"))
+
+class DetectionError(ValueError):
+    """The upload is not a readable image, or no usable position was detected in it."""
+
+class ImageFenCache:
+    """
+    LRU cache from uploaded image content to detected piece placement, so
+    re-uploaded screenshots skip detection. Entries are keyed by the SHA-256 of
+    the raw upload and the `detector` that produced them (see
+    `detector_version`), so swapped weights or detection settings never
+    answer from the old model's results.
+    """
+
+    def __init__(self, max_entries=IMAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def lookup(self, key, detector=None):
+        key = (detector, key)
+        with self._lock:
+            placement = self._entries.get(key)
+            if placement is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return placement
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, key, placement, detector=None):
+        key = (detector, key)
+        with self._lock:
+            self._entries[key] = placement
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "capacity": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+image_cache = ImageFenCache()
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def detector_version():
+    """Everything besides the image that a detected placement depends on."""
+    model = get_model()
+    return f"{model.weights_path}@{model.version}:{DETECTION_MODE}:{BOARD_IMGSZ}:{PIECE_IMGSZ}"
+
+def decode_image_bytes(data):
+    """Decode an encoded image straight from memory; returns None if undecodable."""
+    import cv2
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def placement_to_fen(piece_placement, turn):
+    return f"{piece_placement} {turn} - - 0 1"
 
 def get_fen_from_image(img_path, turn):
-    model = YOLO("weights/best.pt")  # path to your model
+    import cv2
     img = cv2.imread(img_path)
-    h, w, _ = img.shape
+    return get_fens_from_images([img], turn)[0]
+
+def get_fen_from_upload(data, turn):
+    """Detect the FEN of an uploaded image given as raw bytes, without touching disk."""
+    for _, fen in iter_fens_from_uploads([data], turn):
+        if fen is None:
+            raise DetectionError("Could not decode image")
+        check_detected_fen(fen)
+        return fen
 
-    results = model(img)[0]
-    class_names = ['B', 'K', 'N', 'P', 'Q', 'R', 'b', 'board', 'k', 'n', 'p', 'q', 'r']
+def check_detected_fen(fen):
+    """Raise DetectionError unless the detected position is one an engine can analyze."""
+    # Without exactly one king per side Stockfish may crash instead of answering
+    if chess.Board(fen).status() & (chess.STATUS_NO_WHITE_KING | chess.STATUS_NO_BLACK_KING | chess.STATUS_TOO_MANY_KINGS):
+        raise DetectionError(f"No complete chess position detected in the image (got {fen.split()[0]})")
 
-    pieces = []
-    for box in results.boxes:
-        class_id = int(box.cls[0])
-        label = class_names[class_id]
-        if label == 'board':
+def iter_fens_from_uploads(payloads, turn, batch_size=DETECTION_BATCH_SIZE):
+    """
+    Yield `(index, fen)` for raw uploaded images. Cached images are answered
+    immediately; the rest are decoded in memory and detected in batches.
+    Undecodable images yield `(index, None)`.
+    """
+    pending = []
+    detector = detector_version()
+    for idx, data in enumerate(payloads):
+        key = content_hash(data)
+        placement = image_cache.lookup(key, detector)
+        if placement is not None:
+            yield idx, placement_to_fen(placement, turn)
             continue
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        cx = (x1 + x2) / 2
-        cy = (y1 + y2) / 2
-        pieces.append({'label': label, 'cx': cx, 'cy': cy})
 
-    square_h = h / 8
-    square_w = w / 8
+        img = decode_image_bytes(data)
+        if img is None:
+            yield idx, None
+            continue
+        pending.append((idx, img, key))
+
+    images = [img for _, img, _ in pending]
+    for batch_idx, fen in iter_fens_from_images(images, turn, batch_size):
+        idx, _, key = pending[batch_idx]
+        image_cache.store(key, fen.split()[0], detector)
+        yield idx, fen
+
+def get_fens_from_images(images, turn, batch_size=DETECTION_BATCH_SIZE, model=None):
+    """Detect FENs for a list of decoded BGR images using batched forward passes."""
+    fens = [None] * len(images)
+    for idx, fen in iter_fens_from_images(images, turn, batch_size, model):
+        fens[idx] = fen
+    return fens
+
+def iter_fens_from_images(images, turn, batch_size=DETECTION_BATCH_SIZE, model=None):
+    """
+    Yield `(index, fen)` pairs batch by batch, so callers can start working on
+    the first boards while later batches are still being detected. `model`
+    defaults to the served detector.
+    """
+    if model is None:
+        model = get_model()  # loaded and warmed up once per process
+
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+
+        if DETECTION_MODE == "two_stage":
+            # Stage 1: locate the board on a small copy of each screenshot
+            board_results = model.predict(batch, imgsz=BOARD_IMGSZ)
+            crops = [
+                crop_board(img, find_board_box(result, *img.shape[1::-1]))
+                for img, result in zip(batch, board_results)
+            ]
+            # Stage 2: pieces on the rectified board only, at a fixed small size
+            results = model.predict(crops, imgsz=PIECE_IMGSZ)
+            for offset, result in enumerate(results):
+                yield start + offset, detections_to_fen(result, PIECE_IMGSZ, PIECE_IMGSZ, turn)
+        else:
+            results = model.predict(batch)
+            for offset, (img, result) in enumerate(zip(batch, results)):
+                h, w = img.shape[:2]
+                yield start + offset, detections_to_fen(result, w, h, turn)
+
+def boxes_to_arrays(result):
+    """Detections as NumPy arrays: (xyxy [N, 4], confidence [N], class id [N])."""
+    boxes = result.boxes
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+    # Exported backends already return NumPy arrays; PyTorch results are tensors
+    xyxy, conf, cls = (x.cpu().numpy() if hasattr(x, "cpu") else np.asarray(x) for x in (boxes.xyxy, boxes.conf, boxes.cls))
+    return xyxy, conf, cls.astype(int)
+
+def find_board_box(result, w, h):
+    """Most confident `board` detection as integer (x1, y1, x2, y2), or None."""
+    xyxy, conf, cls = boxes_to_arrays(result)
+    candidates = np.flatnonzero(cls == BOARD_CLASS)
+    if candidates.size == 0:
+        return None
+
+    x1, y1, x2, y2 = xyxy[candidates[np.argmax(conf[candidates])]]
+    x1, x2 = int(max(0, np.floor(x1))), int(min(w, np.ceil(x2)))
+    y1, y2 = int(max(0, np.floor(y1))), int(min(h, np.ceil(y2)))
+    if x2 - x1 < 8 or y2 - y1 < 8:
+        return None
+    return x1, y1, x2, y2
+
+def crop_board(img, box, size=PIECE_IMGSZ):
+    """Crop the board and rectify it to a `size` x `size` square; the whole image if no board was found."""
+    import cv2
+    if box is not None:
+        x1, y1, x2, y2 = box
+        img = img[y1:y2, x1:x2]
+    return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+
+def assign_squares(xyxy, conf, cls, w, h):
+    """
+    Map piece detections onto an 8x8 grid in one vectorized pass. When two
+    detections land on the same square the more confident one wins.
+    """
     grid = [['' for _ in range(8)] for _ in range(8)]
+    pieces = cls != BOARD_CLASS
+    if not pieces.any():
+        return grid
+
+    xyxy, conf, cls = xyxy[pieces], conf[pieces], cls[pieces]
+    cols = np.clip(((xyxy[:, 0] + xyxy[:, 2]) / 2 // (w / 8)).astype(int), 0, 7)
+    rows = np.clip(((xyxy[:, 1] + xyxy[:, 3]) / 2 // (h / 8)).astype(int), 0, 7)
+    squares = rows * 8 + cols
+
+    # Sort by square, then by descending confidence, and keep the first per square
+    order = np.lexsort((-conf, squares))
+    _, first = np.unique(squares[order], return_index=True)
+    for idx in order[first]:
+        grid[rows[idx]][cols[idx]] = CLASS_NAMES[cls[idx]]
+    return grid
 
-    for piece in pieces:
-        col = int(piece['cx'] // square_w)
-        row = int(piece['cy'] // square_h)
-        col = min(col, 7)
-        row = min(row, 7)
-        grid[row][col] = piece['label']
+def detections_to_fen(results, w, h, turn):
+    grid = assign_squares(*boxes_to_arrays(results), w, h)
+    return placement_to_fen(grid_to_placement(grid), turn)
 
-    # Convert grid to FEN
+def grid_to_placement(grid):
+    """Piece placement field of the FEN for an 8x8 grid of piece symbols ('' for empty)."""
     fen_rows = []
     for row in grid:
         fen_row = ''
@@ -49,6 +238,4 @@ def get_fen_from_image(img_path, turn):
             fen_row += str(empty)
         fen_rows.append(fen_row)
 
-    piece_placement = '/'.join(fen_rows)
-    fen = f"{piece_placement} {turn} - - 0 1"
-    return fen
+    return '/'.join(fen_rows)
@@ -0,0 +1,253 @@
+# modules/jobs.py
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules.metrics import register_queue
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL = int(os.getenv("JOB_TTL_SECONDS", "600"))
+JOBS_DB_PATH = os.getenv("JOBS_DB", "cache/jobs.sqlite3")
+MAX_JOBS = 1000
+# How often a follower checks the store when no write in its own process woke it up
+JOB_POLL_SECONDS = 0.25
+DONE_STATUSES = ("done", "failed")
+
+class JobStore:
+    """
+    SQLite record of every job's status, result and event log. A job runs in
+    the worker that accepted it, but it is read from here, so status and event
+    requests can be served by any worker of the server.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Jobs are short-lived; skip the fsync on every published event
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    finished REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                )
+            """)
+            db.commit()
+            self._db = db
+        return self._db
+
+    def create(self, job_id, created):
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT INTO jobs (id, status, created) VALUES (?, 'queued', ?)", (job_id, created))
+            db.commit()
+
+    def set_status(self, job_id, status):
+        with self._lock:
+            db = self._connect()
+            db.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+            db.commit()
+
+    def append(self, job_id, event, data):
+        with self._lock:
+            db = self._connect()
+            self._append(db, job_id, event, data)
+            db.commit()
+
+    def finish(self, job_id, result=None, error=None):
+        """Record the outcome and its final `done`/`error` event in one transaction."""
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?",
+                ("failed" if error is not None else "done", time.time(), json.dumps(result), error, job_id),
+            )
+            self._append(db, job_id, *(("error", {"error": error}) if error is not None else ("done", result)))
+            db.commit()
+
+    @staticmethod
+    def _append(db, job_id, event, data):
+        db.execute(
+            "INSERT INTO events SELECT ?, COALESCE(MAX(idx) + 1, 0), ?, ? FROM events WHERE job_id = ?",
+            (job_id, event, json.dumps(data), job_id),
+        )
+
+    def load(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT status, created, finished, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, created, finished, result, error = row
+        return {"status": status, "created": created, "finished": finished,
+                "result": json.loads(result) if result else None, "error": error}
+
+    def events(self, job_id, start=0):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT event, data FROM events WHERE job_id = ? AND idx >= ? ORDER BY idx", (job_id, start)
+            ).fetchall()
+        return [(event, json.loads(data)) for event, data in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict(rows)
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+
+    def expire(self, ttl, max_jobs):
+        """Drop finished jobs older than `ttl`, then the oldest jobs beyond `max_jobs`."""
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (time.time() - ttl,)
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (max_jobs - 1,),
+            )
+            db.execute("DELETE FROM events WHERE job_id NOT IN (SELECT id FROM jobs)")
+            db.commit()
+
+class Job:
+    """
+    A submitted analysis. Stages publish named events (fen, moves,
+    explanations, ...) as they finish; subscribers replay and then follow the
+    event log, so a client connecting late still sees every partial result.
+    State lives in the JobStore; `changed` wakes followers in this process.
+    """
+
+    def __init__(self, store, job_id, changed):
+        self.id = job_id
+        self._store = store
+        self._changed = changed
+
+    @property
+    def status(self):
+        state = self._store.load(self.id)
+        return state["status"] if state else None
+
+    @property
+    def done(self):
+        return self.status in DONE_STATUSES
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def publish(self, event, data):
+        self._store.append(self.id, event, data)
+        self._notify()
+
+    def start(self):
+        self._store.set_status(self.id, "running")
+        self._notify()
+
+    def finish(self, result=None, error=None):
+        self._store.finish(self.id, result=result, error=error)
+        self._notify()
+
+    def iter_events(self, start=0, heartbeat=15):
+        """
+        Yield `(index, event, data)` from `start` until the job is done. Yields
+        `(None, None, None)` every `heartbeat` seconds of silence so streaming
+        responses can keep the connection alive.
+        """
+        index = start
+        quiet_since = time.monotonic()
+        while True:
+            # Status first: once it reads done, the final event is already stored
+            state = self._store.load(self.id)
+            finished = state is None or state["status"] in DONE_STATUSES
+            pending = self._store.events(self.id, index)
+            for event, data in pending:
+                yield index, event, data
+                index += 1
+            if finished:
+                return
+
+            if pending:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= heartbeat:
+                quiet_since = time.monotonic()
+                yield None, None, None
+            with self._changed:
+                self._changed.wait(JOB_POLL_SECONDS)
+
+    def snapshot(self):
+        state = self._store.load(self.id) or {}
+        events = self._store.events(self.id)
+        partial = {event: data for event, data in events if event not in ("done", "error")}
+        return {
+            "job_id": self.id,
+            "status": state.get("status"),
+            "created": state.get("created"),
+            "finished": state.get("finished"),
+            "partial": partial,
+            "result": state.get("result"),
+            "error": state.get("error"),
+        }
+
+class JobManager:
+    """Runs pipelines in the background; any worker can look up a job for polling or streaming."""
+
+    def __init__(self, max_workers=JOB_WORKERS, ttl=JOB_TTL, max_jobs=MAX_JOBS, db_path=JOBS_DB_PATH):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.store = JobStore(db_path)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        register_queue("jobs", self._executor)
+        self._changed = threading.Condition()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn(job.publish, *args, **kwargs)` in the background; its return value is the job result."""
+        self.store.expire(self.ttl, self.max_jobs)
+        job = Job(self.store, uuid.uuid4().hex, self._changed)
+        self.store.create(job.id, time.time())
+
+        def run():
+            job.start()
+            try:
+                job.finish(result=fn(job.publish, *args, **kwargs))
+            except Exception as e:
+                # Some exceptions (e.g. TimeoutError()) have no message; still report a failure
+                error = str(e) or type(e).__name__
+                print(f"Job {job.id} failed: {error}")
+                job.finish(error=error)
+
+        self._executor.submit(run)
+        return job
+
+    def get(self, job_id):
+        if self.store.load(job_id) is None:
+            return None
+        return Job(self.store, job_id, self._changed)
+
+    def stats(self):
+        return self.store.counts()
+
+job_manager = JobManager()
@@ -0,0 +1,333 @@
+# modules/live_stream.py
+
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import threading
+import numpy as np
+import chess
+from modules.model_registry import get_model
+from modules.image_to_fen import (
+    BOARD_IMGSZ, PIECE_IMGSZ, find_board_box, crop_board, boxes_to_arrays, assign_squares,
+    grid_to_placement, placement_to_fen,
+)
+
+# Mean absolute grey-level difference above which a square counts as changed
+SQUARE_DIFF_THRESHOLD = float(os.getenv("STREAM_SQUARE_DIFF", "12"))
+# More changed squares than this means the board moved or the view changed: locate it again
+RESYNC_SQUARES = int(os.getenv("STREAM_RESYNC_SQUARES", "16"))
+STREAM_VIDEO_STRIDE = int(os.getenv("STREAM_VIDEO_STRIDE", "5"))
+MAX_SESSIONS = 64
+SESSION_TTL = int(os.getenv("STREAM_SESSION_TTL_SECONDS", "3600"))
+STREAMS_DB_PATH = os.getenv("STREAMS_DB", "cache/streams.sqlite3")
+# Longest a request may hold a stream; frees streams of workers killed mid-request
+STREAM_LEASE_SECONDS = int(os.getenv("STREAM_LEASE_SECONDS", "120"))
+SIGNATURE_SIZE = 128  # 16x16 grey pixels per square
+
+def square_signature(crop):
+    """Small greyscale copy of a rectified board, cheap enough to diff on every frame."""
+    import cv2
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+def square_differences(signature, reference):
+    """Mean absolute difference per square as an 8x8 array (row 0 is rank 8)."""
+    cell = SIGNATURE_SIZE // 8
+    return np.abs(signature - reference).reshape(8, cell, 8, cell).mean(axis=(1, 3))
+
+def grid_square(row, col):
+    return chess.square(col, 7 - row)
+
+def board_from_grid(grid, turn):
+    """Board for a detected grid, with castling rights wherever kings and rooks are still at home."""
+    board = chess.Board(placement_to_fen(grid_to_placement(grid), turn))
+    board.set_castling_fen("KQkq")
+    board.castling_rights = board.clean_castling_rights()
+    return board
+
+def symbol_at(board, square):
+    piece = board.piece_at(square)
+    return piece.symbol() if piece else ''
+
+def infer_move(board, observed):
+    """
+    The legal move that turns `board` into the `observed` {square: symbol or ''}
+    on every square that changed, touching no square that did not. Returns the
+    move or None when no single legal move explains the change.
+    """
+    changed = set(observed)
+    matches = []
+    for move in board.legal_moves:
+        after = board.copy(stack=False)
+        after.push(move)
+        touched = {sq for sq in chess.SQUARES if after.piece_at(sq) != board.piece_at(sq)}
+        # Squares may also change without a piece moving (last-move highlights), but not the reverse
+        if not touched <= changed:
+            continue
+        if all(symbol_at(after, sq) == symbol for sq, symbol in observed.items()):
+            matches.append(move)
+    return matches[0] if len(matches) == 1 else None
+
+class LiveBoardTracker:
+    """
+    Follows one game across the frames of a screen capture or video. The board
+    is located and fully detected once; after that each frame is only diffed
+    square by square against the last accepted position. Unchanged frames cost
+    a resize and a subtraction, and only the changed squares are re-detected
+    and matched against the legal moves to advance the position. With
+    `sequential=True` (consecutive video frames) a change is first waited out
+    until two frames in a row agree, since a piece may still be in motion.
+    """
+
+    def __init__(self, turn='w', sequential=False):
+        self.id = uuid.uuid4().hex
+        self.turn = turn
+        self.sequential = sequential
+        self.board = None
+        self.box = None
+        self.reference = None
+        self.previous = None
+        self.frames = 0
+        self.touched = time.time()
+        self.counters = {"skipped": 0, "moving": 0, "patch_detections": 0, "full_detections": 0,
+                         "moves": 0, "resyncs": 0}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def process_frame(self, img):
+        """
+        Consume one BGR frame and return an event dict whose `status` is one of
+        `no_board`, `unchanged`, `moving`, `move` (with `move` and `san`) or
+        `resync` (position re-detected from scratch). `fen` is the current position.
+        """
+        with self._lock:
+            self.frames += 1
+            self.touched = time.time()
+            event = self._process(img)
+            event["frame"] = self.frames
+            if self.board is not None:
+                event["fen"] = self.board.fen()
+            return event
+
+    def _process(self, img):
+        if self.board is None:
+            return self._resync(img)
+
+        crop = crop_board(img, self.box)
+        signature = square_signature(crop)
+        changed = square_differences(signature, self.reference) > SQUARE_DIFF_THRESHOLD
+        # Posted frames can be seconds apart, so only video frames are compared with their predecessor
+        moving = self.sequential and self.previous is not None and (
+            square_differences(signature, self.previous) > SQUARE_DIFF_THRESHOLD
+        ).any()
+        self.previous = signature
+
+        if not changed.any():
+            self.counters["skipped"] += 1
+            return {"status": "unchanged"}
+        if changed.sum() > RESYNC_SQUARES:
+            return self._resync(img)
+        if moving:
+            # A piece is still being dragged or animated; act once the frame settles
+            self.counters["moving"] += 1
+            return {"status": "moving"}
+
+        rows, cols = np.nonzero(changed)
+        observed = self._detect_squares(crop, rows, cols)
+        move = infer_move(self.board, observed)
+        if move is None:
+            return self._resync(img)
+
+        san = self.board.san(move)
+        self.board.push(move)
+        self.reference = signature
+        self.counters["moves"] += 1
+        return {"status": "move", "move": move.uci(), "san": san,
+                "changed_squares": sorted(chess.square_name(sq) for sq in observed)}
+
+    def _detect_squares(self, crop, rows, cols):
+        """
+        Re-detect pieces on a patch around the changed squares only, at the same
+        pixels-per-square as a full board pass. Returns {square: symbol or ''}.
+        """
+        cell = PIECE_IMGSZ / 8
+        r1, r2 = max(0, rows.min() - 1), min(8, rows.max() + 2)
+        c1, c2 = max(0, cols.min() - 1), min(8, cols.max() + 2)
+        y1, y2, x1, x2 = int(r1 * cell), int(r2 * cell), int(c1 * cell), int(c2 * cell)
+        patch = crop[y1:y2, x1:x2]
+
+        imgsz = int(np.ceil(max(patch.shape[:2]) / 32) * 32)
+        result = get_model().predict(patch, imgsz=imgsz)[0]
+        self.counters["patch_detections"] += 1
+
+        xyxy, conf, cls = boxes_to_arrays(result)
+        xyxy = xyxy + np.array([x1, y1, x1, y1], dtype=np.float32)
+        grid = assign_squares(xyxy, conf, cls, PIECE_IMGSZ, PIECE_IMGSZ)
+        return {grid_square(r, c): grid[r][c] for r, c in zip(rows, cols)}
+
+    def _resync(self, img):
+        """Locate the board and detect every piece, as a single upload would."""
+        model = get_model()
+        h, w = img.shape[:2]
+        box = find_board_box(model.predict(img, imgsz=BOARD_IMGSZ)[0], w, h)
+        if box is None:
+            if self.board is None:
+                return {"status": "no_board"}
+            box = self.box
+
+        crop = crop_board(img, box)
+        grid = assign_squares(*boxes_to_arrays(model.predict(crop, imgsz=PIECE_IMGSZ)[0]), PIECE_IMGSZ, PIECE_IMGSZ)
+        self.counters["full_detections"] += 1
+
+        # Whoever moved last is unknown after a resync; assume play alternated
+        turn = self.turn if self.board is None else ('b' if self.board.turn == chess.WHITE else 'w')
+        board = board_from_grid(grid, turn)
+        if self.board is not None:
+            self.counters["resyncs"] += 1
+            if board.board_fen() == self.board.board_fen():
+                board = self.board
+
+        self.box = box
+        self.board = board
+        self.reference = self.previous = square_signature(crop)
+        return {"status": "resync"}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stream_id": self.id,
+                "fen": self.board.fen() if self.board is not None else None,
+                "frames": self.frames,
+                **self.counters,
+            }
+
+class StreamRegistry:
+    """
+    Live tracking sessions by id, expired after `ttl` seconds without frames.
+    Trackers are pickled into SQLite between requests, so the next frames of
+    a stream can be posted to any worker. A request checks its tracker out
+    while it processes frames; a second request for the same stream waits
+    for it, which keeps the frames of a stream in order across workers.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, db_path=STREAMS_DB_PATH,
+                 lease=STREAM_LEASE_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.db_path = db_path
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS streams (
+                    id TEXT PRIMARY KEY,
+                    state BLOB NOT NULL,
+                    touched REAL NOT NULL,
+                    leased_until REAL NOT NULL
+                )
+            """)
+            db.commit()
+            self._db = db
+        return self._db
+
+    def create(self, turn='w', checkout=False, sequential=False):
+        """New tracker; with `checkout=True` it is returned already checked out."""
+        tracker = LiveBoardTracker(turn, sequential=sequential)
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM streams WHERE touched < ? AND leased_until < ?", (now - self.ttl, now))
+            db.execute(
+                "DELETE FROM streams WHERE id IN (SELECT id FROM streams ORDER BY touched DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions - 1,),
+            )
+            db.execute(
+                "INSERT INTO streams VALUES (?, ?, ?, ?)",
+                (tracker.id, pickle.dumps(tracker), now, now + self.lease if checkout else 0),
+            )
+            db.commit()
+        return tracker
+
+    def get(self, stream_id):
+        """The tracker as of the last finished request, or None."""
+        with self._lock:
+            row = self._connect().execute("SELECT state FROM streams WHERE id = ?", (stream_id,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def checkout(self, stream_id, timeout=None):
+        """
+        Take the tracker for exclusive use until `checkin`, waiting up to
+        `timeout` seconds (default: the lease) while another request holds it.
+        Returns None for an unknown stream; raises TimeoutError if it stays busy.
+        """
+        deadline = time.monotonic() + (self.lease if timeout is None else timeout)
+        while True:
+            now = time.time()
+            with self._lock:
+                db = self._connect()
+                taken = db.execute(
+                    "UPDATE streams SET leased_until = ? WHERE id = ? AND leased_until < ?",
+                    (now + self.lease, stream_id, now),
+                ).rowcount
+                db.commit()
+                row = db.execute("SELECT state FROM streams WHERE id = ?", (stream_id,)).fetchone()
+            if row is None:
+                return None
+            if taken:
+                return pickle.loads(row[0])
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Stream {stream_id} is busy")
+            time.sleep(0.05)
+
+    def checkin(self, tracker):
+        """Store the tracker's state and hand the stream back."""
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "UPDATE streams SET state = ?, touched = ?, leased_until = 0 WHERE id = ?",
+                (pickle.dumps(tracker), tracker.touched, tracker.id),
+            )
+            db.commit()
+
+    def remove(self, stream_id):
+        with self._lock:
+            db = self._connect()
+            removed = db.execute("DELETE FROM streams WHERE id = ?", (stream_id,)).rowcount
+            db.commit()
+        return removed > 0
+
+stream_registry = StreamRegistry()
+
+def iter_video_frames(path, stride=STREAM_VIDEO_STRIDE):
+    """Yield every `stride`-th decoded frame of a video file."""
+    import cv2
+    capture = cv2.VideoCapture(path)
+    try:
+        index = 0
+        while True:
+            ok = capture.grab()
+            if not ok:
+                return
+            if index % stride == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield frame
+            index += 1
+    finally:
+        capture.release()
@@ -0,0 +1,229 @@
+# modules/metrics.py
+
+import os
+import re
+import time
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    )
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # Optional: without it /metrics is unavailable and metrics are not recorded
+    REGISTRY = None
+
+# Requests slower than this log their per-stage breakdown; 0 disables
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "0"))
+# Also run cProfile on every request and keep the profile of slow ones (adds overhead)
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "0") == "1"
+PROFILES_DIR = os.getenv("PROFILES_DIR", "cache/profiles")
+# Set (to a writable, emptied-at-start directory) when serving with several gunicorn workers
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+class _NoMetric:
+    """Stands in for a labelled metric when prometheus_client is not installed."""
+
+    def labels(self, *values):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+if REGISTRY is not None:
+    REQUEST_LATENCY = Histogram(
+        "chessv_request_seconds", "HTTP request latency until the response is returned",
+        ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+    )
+    STAGE_LATENCY = Histogram(
+        "chessv_stage_seconds", "Latency of one pipeline stage",
+        ["stage"], buckets=LATENCY_BUCKETS,
+    )
+    STAGE_ERRORS = Counter("chessv_stage_errors_total", "Pipeline stages that raised", ["stage"])
+else:
+    REQUEST_LATENCY = STAGE_LATENCY = STAGE_ERRORS = _NoMetric()
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    """The spans recorded while handling one request, for slow-request reports."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, started, seconds):
+        with self._lock:
+            self.spans.append((stage, started - self.start, seconds))
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        lines = [f"Slow request {self.name}: {total * 1000:.0f} ms"]
+        lines += [f"  +{offset * 1000:7.0f} ms  {stage:<20} {seconds * 1000:7.0f} ms"
+                  for stage, offset, seconds in spans]
+        return "\n".join(lines)
+
+@contextmanager
+def span(stage):
+    """Time a block as pipeline stage `stage`: into the stage histogram and the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_LATENCY.labels(stage).observe(seconds)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, started, seconds)
+
+def timed(stage, fn, *args, **kwargs):
+    """Call `fn` inside `span(stage)`; handy for work submitted to executors."""
+    with span(stage):
+        return fn(*args, **kwargs)
+
+def submit_traced(executor, fn, *args, **kwargs):
+    """Submit to `executor` so spans recorded in the worker thread land on the caller's trace."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+_queues = {}
+
+def register_queue(name, executor):
+    """Report `executor`'s backlog as queue depth."""
+    _queues[name] = executor
+
+class StatsCollector:
+    """
+    Point-in-time state read from the in-process caches, engine pools and
+    executors at scrape time. With several workers each scrape reports the
+    worker that served it, labelled by pid.
+    """
+
+    def describe(self):
+        # Registration would otherwise call collect() while the app modules are still importing
+        return []
+
+    def collect(self):
+        from modules.analysis_cache import analysis_cache
+        from modules.image_to_fen import image_cache
+        from modules.fast_path import fast_path
+        from modules.engine_pool import engine_pool_stats
+        from modules.jobs import job_manager
+
+        worker = str(os.getpid())
+
+        events = CounterMetricFamily("chessv_cache_events", "Cache lookups by result", labels=["cache", "result", "worker"])
+        hit_ratio = GaugeMetricFamily("chessv_cache_hit_ratio", "Cache hit ratio since start", labels=["cache", "worker"])
+
+        analysis = analysis_cache.stats()
+        for result in ("memory_hits", "disk_hits", "misses"):
+            events.add_metric(["analysis", result, worker], analysis[result])
+        hit_ratio.add_metric(["analysis", worker], analysis["hit_rate"])
+
+        image = image_cache.stats()
+        for result in ("hits", "misses"):
+            events.add_metric(["image", result, worker], image[result])
+        lookups = image["hits"] + image["misses"]
+        hit_ratio.add_metric(["image", worker], (lookups - image["misses"]) / lookups if lookups else 0.0)
+
+        fast = fast_path.stats()
+        for result in ("book", "tablebase", "engine"):
+            events.add_metric(["fast_path", result, worker], fast[result])
+        hit_ratio.add_metric(["fast_path", worker], fast["hit_rate"])
+        yield events
+        yield hit_ratio
+
+        engines = GaugeMetricFamily("chessv_engine_pool_engines", "Engines by state", labels=["engine", "state", "worker"])
+        utilization = GaugeMetricFamily("chessv_engine_pool_utilization", "Engines in use / pool size", labels=["engine", "worker"])
+        restarts = CounterMetricFamily("chessv_engine_restarts", "Engines replaced after dying", labels=["engine", "worker"])
+        for path, stats in engine_pool_stats().items():
+            name = os.path.basename(path)
+            for state in ("size", "idle", "in_use", "waiting"):
+                engines.add_metric([name, state, worker], stats[state])
+            utilization.add_metric([name, worker], stats["in_use"] / stats["size"])
+            restarts.add_metric([name, worker], stats["restarts"])
+        yield engines
+        yield utilization
+        yield restarts
+
+        depth = GaugeMetricFamily("chessv_queue_depth", "Tasks waiting for a worker thread", labels=["queue", "worker"])
+        for name, executor in list(_queues.items()):
+            depth.add_metric([name, worker], executor._work_queue.qsize())
+        yield depth
+
+        jobs = GaugeMetricFamily("chessv_jobs", "Background jobs of all workers by status", labels=["status", "worker"])
+        for status, count in job_manager.stats().items():
+            jobs.add_metric([status, worker], count)
+        yield jobs
+
+_stats_collector = StatsCollector()
+if REGISTRY is not None and not MULTIPROC_DIR:
+    REGISTRY.register(_stats_collector)
+
+def render_metrics():
+    """Prometheus exposition of every metric; returns `(body, content_type)`, or None without prometheus_client."""
+    if REGISTRY is None:
+        return None
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def mark_worker_dead(pid):
+    """Drop a dead worker's live metric files (gunicorn `child_exit`)."""
+    if REGISTRY is not None and MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+class RequestTimer:
+    """
+    Per-request timing: the latency histogram for every request, and for
+    requests over SLOW_REQUEST_MS a logged span breakdown plus, with
+    PROFILE_SLOW_REQUESTS, a cProfile dump of the request thread.
+    """
+
+    def __init__(self, name):
+        self.trace = Trace(name)
+        self._token = _trace.set(self.trace)
+        self._profile = None
+        if PROFILE_SLOW_REQUESTS:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self._profile = profile
+            except ValueError:
+                pass  # Another request on this interpreter is already being profiled
+
+    def finish(self, endpoint, method, status):
+        if self._profile is not None:
+            self._profile.disable()
+        _trace.reset(self._token)
+
+        seconds = time.perf_counter() - self.trace.start
+        REQUEST_LATENCY.labels(endpoint, method, str(status)).observe(seconds)
+        if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+            print(self.trace.report())
+            if self._profile is not None:
+                os.makedirs(PROFILES_DIR, exist_ok=True)
+                slug = re.sub(r"\W+", "_", endpoint).strip("_") or "root"
+                path = os.path.join(PROFILES_DIR, f"{int(time.time() * 1000)}-{os.getpid()}-{slug}.prof")
+                self._profile.dump_stats(path)
+                print(f"  profile written to {path} (view with: python -m pstats {path})")
+        return seconds
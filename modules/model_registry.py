@@ -0,0 +1,172 @@
+# modules/model_registry.py
+
+import os
+import json
+import threading
+import numpy as np
+from modules.detector_backends import backend_for, load_detector
+from modules.metrics import span
+
+WEIGHTS_DIR = "weights"
+DEFAULT_MODEL = "board_detector"
+DEFAULT_WEIGHTS = os.getenv("YOLO_WEIGHTS", os.path.join(WEIGHTS_DIR, "best.pt"))
+WARMUP_SIZE = 640
+# Weights swapped in at runtime, by model name. Every worker process follows this file.
+MODEL_STATE_PATH = os.getenv("MODEL_STATE_FILE", "cache/models.json")
+
+class LoadedModel:
+    """A loaded detector plus the lock that serializes inference on it."""
+
+    def __init__(self, name, weights_path, model):
+        self.name = name
+        self.weights_path = weights_path
+        self.backend = backend_for(weights_path)
+        # Weights overwritten in place load as a new version too
+        self.version = os.stat(weights_path).st_mtime_ns
+        self.model = model
+        self._lock = threading.Lock()
+
+    def predict(self, source, **kwargs):
+        # Ultralytics predictors keep per-call state and are not safe to share
+        # between threads without serializing calls.
+        with self._lock, span("detector_inference"):
+            return self.model(source, verbose=False, **kwargs)
+
+    def warm_up(self):
+        """Run one dummy inference so graph setup is not paid by the first request."""
+        dummy = np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)
+        self.predict(dummy)
+
+class ModelRegistry:
+    """
+    Process-wide registry of detector models, loaded once and shared by every
+    request. Weights can be swapped at runtime: the new model is loaded and
+    warmed up off to the side, then replaces the old one atomically. A swap
+    is published to MODEL_STATE_PATH and the other worker processes of the
+    server pick it up on their next request (see `sync`).
+    """
+
+    def __init__(self, state_path=MODEL_STATE_PATH):
+        self.state_path = state_path
+        self._models = {}
+        self._published = {}
+        self._state_mtime = None
+        self._lock = threading.Lock()
+
+    def get(self, name=DEFAULT_MODEL, weights_path=DEFAULT_WEIGHTS, warm_up=True):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._build(name, self._published.get(name, weights_path), warm_up)
+                self._models[name] = model
+            return model
+
+    def load(self, weights_path, name=DEFAULT_MODEL):
+        """Load `weights_path` under `name`, replacing any model already registered, in every worker."""
+        model = self._build(name, weights_path)
+        with self._lock:
+            self._models[name] = model
+            self._publish(name, weights_path)
+        print(f"Model '{name}' now serving weights from {weights_path}")
+        return model
+
+    def sync(self, wait=False):
+        """
+        Follow swaps published by other processes: load any model whose
+        published weights differ from the ones served here, in the background
+        unless `wait`. Costs one stat() when nothing changed.
+        """
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._state_mtime:
+            return
+
+        with self._lock:
+            if mtime == self._state_mtime:
+                return
+            self._state_mtime = mtime
+            try:
+                with open(self.state_path) as f:
+                    self._published = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read published models: {e}")
+                return
+            stale = {name: path for name, path in self._published.items()
+                     if name in self._models and self._models[name].weights_path != path}
+
+        for name, weights_path in stale.items():
+            if wait:
+                self._follow(name, weights_path)
+            else:
+                threading.Thread(target=self._follow, args=(name, weights_path), daemon=True).start()
+
+    def _follow(self, name, weights_path):
+        try:
+            model = self._build(name, weights_path)
+        except Exception as e:
+            print(f"Failed to follow reload of model '{name}': {e}")
+            return
+        with self._lock:
+            # A newer swap may have been published while this one loaded
+            if self._published.get(name) == weights_path:
+                self._models[name] = model
+                print(f"Model '{name}' now serving weights from {weights_path}")
+
+    def _publish(self, name, weights_path):
+        published = dict(self._published, **{name: weights_path})
+        try:
+            with open(self.state_path) as f:
+                published = dict(json.load(f), **{name: weights_path})
+        except (OSError, ValueError):
+            pass
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(published, f)
+        os.replace(tmp_path, self.state_path)
+        self._published = published
+        self._state_mtime = os.stat(self.state_path).st_mtime_ns
+
+    def info(self):
+        return {name: {"weights": model.weights_path, "backend": model.backend} for name, model in self._models.items()}
+
+    def _build(self, name, weights_path, warm_up=True):
+        if not os.path.exists(weights_path):
+            raise FileNotFoundError(f"Model weights not found: {weights_path}")
+        print(f"Loading model '{name}' from {weights_path} ({backend_for(weights_path)} backend)")
+        model = LoadedModel(name, weights_path, load_detector(weights_path))
+        if warm_up:
+            model.warm_up()
+        return model
+
+registry = ModelRegistry()
+
+def get_model(name=DEFAULT_MODEL):
+    return registry.get(name)
+
+def reload_model(weights_path, name=DEFAULT_MODEL):
+    return registry.load(weights_path, name)
+
+def sync_models(wait=False):
+    return registry.sync(wait)
+
+def clear_published_models():
+    """Forget runtime swaps so a freshly started server serves the configured weights."""
+    try:
+        os.remove(MODEL_STATE_PATH)
+    except FileNotFoundError:
+        pass
+
+def preload_model(name=DEFAULT_MODEL):
+    """
+    Load weights without running inference. A pre-forking server calls this in
+    its master so workers share the weights copy-on-write; each worker warms
+    the model up itself, since inference thread pools do not survive fork.
+    """
+    return registry.get(name, warm_up=False)
@@ -1,18 +1,165 @@
 # modules/simulate_and_save_sequences.py
 
-import os
+import threading
+from collections import OrderedDict
 import chess
+from PIL import Image
 from modules.chess_engine import render_board_with_move
+from modules.board_renderer import BOARD_SIZE, get_renderer
+from modules.artifact_store import artifact_store, artifact_key
 
-def simulate_and_save_sequences(board, suggestions, output_dir="static/artifacts/sequences"):
-    os.makedirs(output_dir, exist_ok=True)
+SEQUENCES_DIR = "sequences"
+SHEET_COLUMNS = 8
+ANIMATION_FRAME_MS = 800
+ANIMATION_FORMATS = {"gif": "GIF", "webp": "WEBP"}
+MAX_ANALYSES = 256
 
-    for idx, (move, pv_line, score) in enumerate(suggestions, 1):
-        subdir = os.path.join(output_dir, f"move_{idx}_{move.uci()}")
-        os.makedirs(subdir, exist_ok=True)
+class SequenceRegistry:
+    """
+    Maps the suggestion numbers of recent analyses to their PV lines so frames
+    can be rendered on demand, the first time a client asks for them. Lines are
+    content-addressed (FEN + PV + render options), so parallel analyses never
+    share or overwrite each other's frames. Lookups always name the analysis:
+    a suggestion number alone would resolve against another client's board.
+    """
 
-        temp_board = board.copy()
-        for step, m in enumerate(pv_line, 1):
-            temp_board.push(m)
-            file_path = os.path.join(subdir, f"step_{step}_{m.uci()}.png")
-            render_board_with_move(temp_board, m, output_path=file_path)
+    def __init__(self, max_analyses=MAX_ANALYSES):
+        self.max_analyses = max_analyses
+        self._analyses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, board, suggestions):
+        lines = {}
+        for idx, (move, pv_line, score) in enumerate(suggestions, 1):
+            pv = [m.uci() for m in pv_line]
+            line_id = artifact_key(kind="line", fen=board.fen(), pv=pv, size=BOARD_SIZE)
+            line = {
+                "move_id": idx,
+                "move_uci": move.uci(),
+                "fen": board.fen(),
+                "pv": pv,
+                "folder_name": line_id,
+            }
+            artifact_store.put_line(line_id, line)
+            lines[idx] = line
+
+        analysis_id = artifact_key(kind="analysis", lines=[line["folder_name"] for line in lines.values()])
+        # Also in the shared manifest, so any worker process can resolve this analysis id
+        artifact_store.put_line(analysis_id, {str(idx): line["folder_name"] for idx, line in lines.items()})
+        with self._lock:
+            self._analyses[analysis_id] = lines
+            self._analyses.move_to_end(analysis_id)
+            while len(self._analyses) > self.max_analyses:
+                self._analyses.popitem(last=False)
+        return analysis_id, lines
+
+    def get(self, analysis_id, move_id):
+        with self._lock:
+            lines = self._analyses.get(analysis_id)
+        if lines is not None:
+            return lines.get(move_id)
+
+        # Registered by another worker process
+        line_ids = artifact_store.get_line(analysis_id)
+        if not line_ids or str(move_id) not in line_ids:
+            return None
+        return artifact_store.get_line(line_ids[str(move_id)])
+
+sequence_registry = SequenceRegistry()
+
+def frame_names(line):
+    return [f"step_{step}_{uci}.png" for step, uci in enumerate(line["pv"], 1)]
+
+def frame_path(line, frame_name):
+    return f"{SEQUENCES_DIR}/{line['folder_name']}/{frame_name}"
+
+def iter_line_boards(line):
+    """Yield `(board, move)` after each ply of the line's PV."""
+    board = chess.Board(line["fen"])
+    for uci in line["pv"]:
+        move = chess.Move.from_uci(uci)
+        board.push(move)
+        yield board, move
+
+def register_sequences(board, suggestions):
+    """Record suggested lines for lazy rendering; nothing is drawn yet. Returns `(analysis_id, lines)`."""
+    return sequence_registry.register(board, suggestions)
+
+def ensure_sequence_frame(line_id, frame_name):
+    """
+    Render a single frame, or the sheet or an animation, of a known line if it
+    is not stored yet. Returns its relative path or None.
+    """
+    line = artifact_store.get_line(line_id)
+    if line is None:
+        return None
+    fmt = next((fmt for fmt in ["sheet", *ANIMATION_FORMATS] if animation_name(fmt) == frame_name), None)
+    if fmt is not None:
+        return render_line_animation(line, fmt)
+    if frame_name not in frame_names(line):
+        return None
+
+    step = frame_names(line).index(frame_name) + 1
+    for ply, (board, move) in enumerate(iter_line_boards(line), 1):
+        if ply == step:
+            board = board.copy()
+            return artifact_store.get_or_create(
+                frame_path(line, frame_name),
+                lambda path: render_board_with_move(board, move, output_path=path),
+            )
+
+def ensure_sequence_frames(analysis_id, move_id):
+    """Render (or reuse) every frame of a line. Returns the line info or None."""
+    line = sequence_registry.get(analysis_id, move_id)
+    if line is None:
+        return None
+
+    for (board, move), name in zip(iter_line_boards(line), frame_names(line)):
+        artifact_store.get_or_create(
+            frame_path(line, name),
+            lambda path: render_board_with_move(board, move, output_path=path),
+        )
+    return line
+
+def render_sequence_animation(analysis_id, move_id, fmt="webp"):
+    """
+    Render a whole line as one image: a sprite sheet (`fmt="sheet"`, PNG) or an
+    animated GIF/WebP, stored next to the frames. Returns its relative path.
+    """
+    line = sequence_registry.get(analysis_id, move_id)
+    if line is None:
+        return None
+    if fmt != "sheet" and fmt not in ANIMATION_FORMATS:
+        raise ValueError(f"Unsupported sequence format: {fmt}")
+    return render_line_animation(line, fmt)
+
+def animation_name(fmt):
+    return "sheet.png" if fmt == "sheet" else f"sequence.{fmt}"
+
+def render_line_animation(line, fmt):
+    if not line["pv"]:
+        return None
+
+    def render(path):
+        renderer = get_renderer()
+        frames = [renderer.render(board, move) for board, move in iter_line_boards(line)]
+        if fmt == "sheet":
+            width, height = frames[0].size
+            columns = min(SHEET_COLUMNS, len(frames))
+            rows = (len(frames) + columns - 1) // columns
+            sheet = Image.new("RGB", (width * columns, height * rows))
+            for i, frame in enumerate(frames):
+                sheet.paste(frame, ((i % columns) * width, (i // columns) * height))
+            sheet.save(path, format="PNG")
+        else:
+            frames[0].save(path, format=ANIMATION_FORMATS[fmt], save_all=True,
+                           append_images=frames[1:], duration=ANIMATION_FRAME_MS, loop=0)
+
+    return artifact_store.get_or_create(frame_path(line, animation_name(fmt)), render)
+
+def simulate_and_save_sequences(board, suggestions):
+    """Eagerly render every frame of every line (kept for scripts and notebooks)."""
+    analysis_id, lines = register_sequences(board, suggestions)
+    for idx in lines:
+        ensure_sequence_frames(analysis_id, idx)
+    return analysis_id
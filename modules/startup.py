@@ -0,0 +1,139 @@
+# modules/startup.py
+
+import os
+import sys
+import time
+import threading
+import subprocess
+
+# Cold import of the app must stay under this, measured in a fresh interpreter
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+# Importing the app must never pull these in; they load on first use or during warm-up
+LAZY_MODULES = ("torch", "ultralytics", "onnxruntime", "openvino", "cairosvg", "IPython", "groq", "cv2")
+COMPONENTS = ("engine_pool", "detector", "renderer")
+
+class Readiness:
+    """
+    Tracks which expensive components have been warmed up in this process. The
+    server answers liveness checks right away; readiness flips once every
+    component is warm, so load balancers only route traffic to warm workers.
+    """
+
+    def __init__(self, components=COMPONENTS):
+        self.started = time.time()
+        self._state = {name: {"ready": False, "seconds": None, "error": None} for name in components}
+        self._lock = threading.Lock()
+        self._started = False
+        self._thread = None
+
+    def warm_up(self, name, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+            with self._lock:
+                self._state[name]["error"] = str(e)
+            return
+        with self._lock:
+            self._state[name].update(ready=True, seconds=round(time.perf_counter() - start, 3), error=None)
+        print(f"{name} ready in {self._state[name]['seconds']}s")
+
+    def warm_up_all(self):
+        """Warm every component in turn (blocking)."""
+        with self._lock:
+            self._started = True
+        from modules.engine_pool import ENGINE_PATH, get_engine_pool
+        from modules.model_registry import get_model, sync_models
+        from modules.board_renderer import get_renderer
+
+        self.warm_up("engine_pool", lambda: get_engine_pool(ENGINE_PATH).warm_up())
+        def warm_up_detector():
+            # A worker started after a runtime reload serves the reloaded weights too
+            sync_models(wait=True)
+            get_model().warm_up()
+
+        self.warm_up("detector", warm_up_detector)
+        self.warm_up("renderer", get_renderer)
+
+    def start_background_warm_up(self):
+        """
+        Warm up in a daemon thread so the server can start answering
+        immediately. Does nothing if this process has already started warming up.
+        """
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self._thread = threading.Thread(target=self.warm_up_all, name="warm-up", daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def snapshot(self):
+        with self._lock:
+            components = {name: dict(state) for name, state in self._state.items()}
+        return {
+            "ready": all(state["ready"] for state in components.values()),
+            "uptime": round(time.time() - self.started, 3),
+            "components": components,
+        }
+
+readiness = Readiness()
+
+def measure_import_time(module="flask_app"):
+    """
+    Import `module` in a fresh interpreter with `-X importtime`. Returns the
+    total milliseconds, its slowest direct imports and any LAZY_MODULES that
+    were imported eagerly.
+    """
+    probe = (
+        f"import sys; import {module}; "
+        f"print('LOADED', ' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        capture_output=True, text=True, check=True,
+    )
+
+    total_ms = 0.0
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if not cum.strip().isdigit():
+            continue
+        # Nesting is shown by indentation: " name" is top level, "   name" its direct import
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == module:
+            total_ms = int(cum) / 1000
+        elif depth == 1:
+            children[name.strip()] = int(cum) / 1000
+
+    loaded = result.stdout.split("LOADED", 1)[1].split() if "LOADED" in result.stdout else []
+    slowest = sorted(children.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "module": module,
+        "total_ms": round(total_ms, 1),
+        "slowest": [{"module": name, "ms": round(ms, 1)} for name, ms in slowest],
+        "eager_heavy_imports": loaded,
+    }
+
+def check_import_budget(module="flask_app", budget_ms=IMPORT_TIME_BUDGET_MS):
+    """Print the import-time report; returns False if over budget or a lazy dependency loads eagerly."""
+    report = measure_import_time(module)
+    print(f"Import of {module}: {report['total_ms']} ms (budget {budget_ms} ms)")
+    for entry in report["slowest"]:
+        print(f"  {entry['ms']:8.1f} ms  {entry['module']}")
+
+    ok = True
+    if report["total_ms"] > budget_ms:
+        print("FAIL: import time over budget")
+        ok = False
+    if report["eager_heavy_imports"]:
+        print(f"FAIL: imported eagerly: {', '.join(report['eager_heavy_imports'])}")
+        ok = False
+    return ok
+
+if __name__ == '__main__':
+    # python -m modules.startup [module]  -- exits non-zero on a startup regression
+    sys.exit(0 if check_import_budget(*sys.argv[1:2]) else 1)
@@ -54,6 +54,7 @@ interface AdvancedAnalysis {
 
 interface ChessAnalysisResult {
   fen: string
+  analysis_id?: string
   rendered_images: string[]
   explanations: [string, ParsedExplanation | string][]
   suggestions: [string, string, number | string][]
@@ -185,7 +186,8 @@ export default function ChessResults() {
     try {
       console.log(`Fetching sequence for move ${moveIndex + 1}`)
       // Fetch the sequence images for this move
-      const response = await fetch(`http://localhost:5000/api/sequence/${moveIndex + 1}`)
+      const query = results?.analysis_id ? `?analysis_id=${results.analysis_id}` : ""
+      const response = await fetch(`http://localhost:5000/api/sequence/${moveIndex + 1}${query}`)
 
       if (!response.ok) {
         const errorData = await response.json()